@@ -1,18 +1,380 @@
+import argparse
+import json
 import logging
+import os
+import sys
 from pathlib import Path
-from pprint import pprint as pp
 
-from board2kconf.configurator import Configurator
-from board2kconf.model import BoardDatabase
-from .util import find_klipper
-from .ui import UI
+# Keep imports here to a minimum, anything heavy (especially kconfiglib, via the configurator)
+# is imported by the command that needs it. See check_ezf_startup.
 
 logger = logging.getLogger("klipper-mcu-configs")
 
 
+def _generate_all(args):
+    from .batch import generate_all, match_boards
+    from .model import BoardDatabase
+    from .util import find_klipper
+
+    boards = match_boards(BoardDatabase(lazy=True).get_all(), args.filter)
+    if not boards:
+        print(f"No boards match {args.filter}")
+        return 1
+    klipper = args.klipper or find_klipper()
+    jobs = args.jobs or os.cpu_count() or 1
+    failed = 0
+    written = 0
+    for board, if_type, path, error in generate_all(
+        klipper, boards, args.out, args.interface, jobs
+    ):
+        if error:
+            failed += 1
+            print(f"FAILED {board}/{if_type}: {error}")
+        else:
+            written += 1
+            print(f"Wrote {path}")
+    print(f"{written} configs written, {failed} failed")
+    return 1 if failed else 0
+
+
+def _build(args):
+    from .artifacts import ArtifactStore, cache_limit_bytes
+    from .batch import match_boards
+    from .build import build_all
+    from .model import BoardDatabase
+    from .util import find_klipper, get_cache_dir
+
+    boards = match_boards(BoardDatabase(lazy=True).get_all(), args.filter)
+    if not boards:
+        print(f"No boards match {args.filter}")
+        return 1
+    klipper = args.klipper or find_klipper()
+    jobs = args.jobs or os.cpu_count() or 1
+    build_root = get_cache_dir("build") or args.out / ".build"
+    store = None if args.no_store else ArtifactStore.default()
+    failed = 0
+    built = 0
+    for board, if_type, path, result, error in build_all(
+        klipper,
+        boards,
+        args.out,
+        build_root,
+        args.interface,
+        args.make,
+        jobs,
+        args.make_jobs,
+        store,
+        cache_limit_bytes(),
+    ):
+        if error:
+            failed += 1
+            print(f"FAILED {board}/{if_type}: {error}")
+        else:
+            built += 1
+            action = "Reused" if result.cached else "Built"
+            print(f"{action} {path.with_suffix('')}")
+    print(f"{built} firmwares built, {failed} failed")
+    return 1 if failed else 0
+
+
+def _emit(args, data, text: str):
+    if args.json:
+        print(json.dumps(data, indent=2))
+    else:
+        print(text)
+
+
+def _fail(args, error: Exception) -> int:
+    if args.json:
+        print(json.dumps({"error": str(error)}, indent=2))
+    else:
+        print(f"Error: {error}", file=sys.stderr)
+    return 1
+
+
+def _boards(args):
+    from .batch import match_boards
+    from .model import BoardDatabase
+
+    boards = match_boards(BoardDatabase(lazy=True).get_all(), args.filter)
+    _emit(args, [board.as_dict() for board in boards], "\n".join(map(str, boards)))
+    return 0
+
+
+def _search(args):
+    from .model import BoardDatabase
+
+    text = " ".join(args.text)
+    boards = BoardDatabase(lazy=True).search(text, args.limit)
+    if not boards and not args.json:
+        print(f"No boards match {text}", file=sys.stderr)
+        return 1
+    _emit(args, [board.as_dict() for board in boards], "\n".join(map(str, boards)))
+    return 0 if boards else 1
+
+
+def _query(args):
+    from .model import BoardDatabase
+
+    boards = BoardDatabase(lazy=True).query(
+        arch=args.arch,
+        mcu=args.mcu,
+        clock=args.clock,
+        flash=args.flash,
+        interface=args.interface,
+        pins=args.pins,
+    )
+    if not boards and not args.json:
+        print("No boards match", file=sys.stderr)
+        return 1
+    _emit(args, [board.as_dict() for board in boards], "\n".join(map(str, boards)))
+    return 0 if boards else 1
+
+
+def _describe(args):
+    from .model import BoardDatabase
+
+    try:
+        board = BoardDatabase(lazy=True).find(args.board)
+    except ValueError as e:
+        return _fail(args, e)
+    _emit(args, board.as_dict(), board.pretty().rstrip("\n"))
+    return 0
+
+
+def _configure(args):
+    from .configurator import generate_config
+    from .model import BoardDatabase
+    from .util import find_klipper
+
+    try:
+        board = BoardDatabase(lazy=True).find(args.board)
+        interface = board.interface(args.interface)
+        generated = generate_config(
+            args.klipper or find_klipper(),
+            board,
+            interface,
+            args.out,
+            skip_unchanged=args.skip_unchanged,
+        )
+    except (ValueError, RuntimeError, KeyError, OSError) as e:
+        return _fail(args, e)
+    result = {
+        "board": str(board),
+        "interface": interface.if_type,
+        "path": str(args.out.absolute()),
+        "cached": generated.cached,
+        "written": generated.written,
+    }
+    _emit(
+        args,
+        result,
+        f"Wrote {args.out}" if generated.written else f"No change to {args.out}",
+    )
+    return 0
+
+
+def _daemon(args):
+    from .daemon import default_socket_path, run
+    from .util import find_klipper
+
+    run(args.klipper or find_klipper(), args.socket or default_socket_path())
+    return 0
+
+
+def _add_board_selection(subparser: argparse.ArgumentParser, out_help: str):
+    subparser.add_argument(
+        "-o",
+        "--out",
+        type=Path,
+        required=True,
+        help=out_help,
+    )
+    subparser.add_argument(
+        "-f",
+        "--filter",
+        default="*",
+        help="Only boards whose manufacturer/model/variant matches this glob (case-insensitive)",
+    )
+    subparser.add_argument(
+        "-i",
+        "--interface",
+        nargs="+",
+        choices=("usb", "can", "uart"),
+        help="Only these interface types (default: all that each board supports)",
+    )
+    subparser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=0,
+        help="Number of boards to configure (or build) in parallel (default: one per CPU)",
+    )
+    subparser.add_argument(
+        "--klipper", type=Path, help="Klipper checkout to use (default: autodetect)"
+    )
+
+
 def main():
     logging.basicConfig(level=logging.INFO)
 
+    parser = argparse.ArgumentParser(prog="ezf")
+    parser.add_argument(
+        "--trace",
+        metavar="PATH",
+        help="Record where time is spent, writing a Chrome trace to PATH and a summary to stderr at exit",
+    )
+    subparsers = parser.add_subparsers(dest="command")
+
+    generate_parser = subparsers.add_parser(
+        "generate-all", help="Write .config files for many boards at once"
+    )
+    _add_board_selection(
+        generate_parser,
+        "Directory to write <manufacturer>/<model>/<variant>/<interface>.config into",
+    )
+    generate_parser.set_defaults(func=_generate_all)
+
+    build_parser = subparsers.add_parser(
+        "build", help="Write .config files for many boards, and build klipper for each"
+    )
+    _add_board_selection(
+        build_parser,
+        "Directory to write <manufacturer>/<model>/<variant>/<interface>.config into, "
+        "with the firmware in <interface>/ beside each",
+    )
+    build_parser.add_argument(
+        "--make",
+        default="make",
+        help="Make command to build klipper with (default: make)",
+    )
+    build_parser.add_argument(
+        "--make-jobs",
+        type=int,
+        default=1,
+        help="Number of jobs each make runs with (default: 1)",
+    )
+    build_parser.add_argument(
+        "--no-store",
+        action="store_true",
+        help="Always run make, rather than reusing firmware built from the same klipper commit and settings",
+    )
+    build_parser.set_defaults(func=_build)
+
+    boards_parser = subparsers.add_parser("boards", help="List the known boards")
+    boards_parser.add_argument(
+        "-f",
+        "--filter",
+        default="*",
+        help="Only boards whose manufacturer/model/variant matches this glob (case-insensitive)",
+    )
+    boards_parser.set_defaults(func=_boards)
+
+    search_parser = subparsers.add_parser(
+        "search",
+        help="Find boards by (part of) their manufacturer, model, variant or MCU",
+    )
+    search_parser.add_argument("text", nargs="+", help="What to search for")
+    search_parser.add_argument(
+        "-n",
+        "--limit",
+        type=int,
+        default=20,
+        help="Maximum number of boards to list, best match first (default: 20)",
+    )
+    search_parser.set_defaults(func=_search)
+
+    query_parser = subparsers.add_parser(
+        "query",
+        help="List the boards with the given hardware (every option given must match, case-insensitively)",
+    )
+    query_parser.add_argument(
+        "--arch", help='Architecture, e.g. "STMicroelectronics STM32"'
+    )
+    query_parser.add_argument("--mcu", help="MCU model, e.g. stm32g0b1")
+    query_parser.add_argument("--clock", help="Clock reference, e.g. 8MHz")
+    query_parser.add_argument("--flash", help="Flash chip, e.g. w25q080")
+    query_parser.add_argument(
+        "--interface", choices=("usb", "can", "uart"), help="Interface type"
+    )
+    query_parser.add_argument(
+        "--pins",
+        nargs="+",
+        default=(),
+        help="Pins used by the interface (or by any interface, without --interface)",
+    )
+    query_parser.set_defaults(func=_query)
+
+    describe_parser = subparsers.add_parser(
+        "describe", help="Show what the board database says about a board"
+    )
+    describe_parser.add_argument(
+        "-b", "--board", required=True, help="The board, as manufacturer/model/variant"
+    )
+    describe_parser.set_defaults(func=_describe)
+
+    configure_parser = subparsers.add_parser(
+        "configure", help="Write the .config for one board and interface"
+    )
+    configure_parser.add_argument(
+        "-b", "--board", required=True, help="The board, as manufacturer/model/variant"
+    )
+    configure_parser.add_argument(
+        "-i",
+        "--interface",
+        required=True,
+        choices=("usb", "can", "uart"),
+        help="The interface klipper will talk to the board over",
+    )
+    configure_parser.add_argument(
+        "-o", "--out", type=Path, required=True, help="Where to write the .config"
+    )
+    configure_parser.add_argument(
+        "--klipper", type=Path, help="Klipper checkout to use (default: autodetect)"
+    )
+    configure_parser.add_argument(
+        "--skip-unchanged",
+        action="store_true",
+        help="Leave --out alone if it already has the same settings, so klipper does not rebuild everything",
+    )
+    configure_parser.set_defaults(func=_configure)
+
+    for scriptable_parser in (
+        boards_parser,
+        search_parser,
+        query_parser,
+        describe_parser,
+        configure_parser,
+    ):
+        scriptable_parser.add_argument(
+            "--json", action="store_true", help="Print the result as JSON"
+        )
+
+    daemon_parser = subparsers.add_parser(
+        "daemon",
+        help="Serve JSON-RPC requests for board listings and configs over a Unix socket",
+    )
+    daemon_parser.add_argument(
+        "--socket",
+        type=Path,
+        help="Socket to listen on (default: $XDG_RUNTIME_DIR/ezflash.sock)",
+    )
+    daemon_parser.add_argument(
+        "--klipper", type=Path, help="Klipper checkout to use (default: autodetect)"
+    )
+    daemon_parser.set_defaults(func=_daemon)
+
+    args = parser.parse_args()
+    if args.trace:
+        # Must happen before anything traced is imported
+        from .trace import enable
+
+        enable(args.trace)
+    if args.command is not None:
+        raise SystemExit(args.func(args))
+
+    from .ui import UI
+
     ui = UI()
     ui.launch()
 
@@ -0,0 +1,184 @@
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+from os import PathLike
+from pathlib import Path
+from typing import Collection, Iterable, List, Optional
+
+from .util import get_cache_dir
+
+logger = logging.getLogger(__name__)
+
+# Print hosts often run from SD cards, keep the store small unless asked otherwise
+_DEFAULT_MAX_MB = 256
+_META = "meta.json"
+
+
+def artifact_key(klipper_revision: str, config_hash: str, toolchain_hash: str) -> str:
+    """
+    The store key for firmware built by a klipper commit from a config (hashed with build.config_hash),
+    with a toolchain (hashed with build.toolchain_hash)
+    """
+    return hashlib.sha256(
+        f"{klipper_revision}:{config_hash}:{toolchain_hash}".encode("utf-8")
+    ).hexdigest()
+
+
+def cache_limit_bytes() -> int:
+    """
+    How large the firmware store (and, separately, the build directories) may grow: $KBOARD_FIRMWARE_CACHE_MB
+    """
+    return (
+        int(os.environ.get("KBOARD_FIRMWARE_CACHE_MB") or _DEFAULT_MAX_MB) * 1024 * 1024
+    )
+
+
+def _tree_size(path: Path) -> int:
+    # Symlinks (such as a build's board link) are counted as themselves, never followed
+    total = 0
+    for parent, _, names in os.walk(path):
+        for name in names:
+            try:
+                total += os.lstat(os.path.join(parent, name)).st_size
+            except OSError:
+                continue
+    return total
+
+
+def evict_lru(
+    entries: Iterable[PathLike], max_bytes: int, keep: Collection[PathLike] = ()
+) -> int:
+    """
+    Remove the least recently used (by mtime) of the given directories, until they fit in max_bytes
+    :param keep: Directories that count towards the total, but are never removed
+    :return: The number of directories removed
+    """
+    keep = {Path(x) for x in keep}
+    sized = []
+    total = 0
+    for entry in map(Path, entries):
+        try:
+            mtime = entry.stat().st_mtime
+        except OSError:
+            continue
+        size = _tree_size(entry)
+        sized.append((mtime, size, entry))
+        total += size
+    removed = 0
+    for _, size, entry in sorted(sized):
+        if total <= max_bytes:
+            break
+        if entry in keep:
+            continue
+        logger.debug(f"Evicting {entry}")
+        shutil.rmtree(entry, ignore_errors=True)
+        total -= size
+        removed += 1
+    return removed
+
+
+class ArtifactStore(object):
+    """
+    A content-addressed store of built firmware, keyed on the klipper commit, the config's settings and the
+    toolchain.
+
+    Each entry is a directory holding the artifacts of one build. Entries are evicted least recently used
+    first (by the mtime of their directory, which is bumped on every hit) once the store outgrows max_bytes.
+    """
+
+    def __init__(self, root: PathLike, max_bytes: int = _DEFAULT_MAX_MB * 1024 * 1024):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+
+    @classmethod
+    def default(cls) -> Optional["ArtifactStore"]:
+        """
+        The store in the ezflash cache, sized by $KBOARD_FIRMWARE_CACHE_MB, or None if caching is unavailable
+        """
+        if (root := get_cache_dir("firmware")) is None:
+            return None
+        return cls(root, cache_limit_bytes())
+
+    def _entry(self, key: str) -> Path:
+        return self.root / key[:2] / key
+
+    def get(
+        self, klipper_revision: str, config_hash: str, toolchain_hash: str
+    ) -> Optional[List[Path]]:
+        """
+        Return the stored artifacts for a build, or None if it has not been stored
+        """
+        entry = self._entry(artifact_key(klipper_revision, config_hash, toolchain_hash))
+        try:
+            meta = json.loads((entry / _META).read_text())
+            artifacts = [entry / name for name in meta["artifacts"]]
+            if not all(x.is_file() for x in artifacts):
+                return None
+            os.utime(entry)
+        except (OSError, ValueError, KeyError):
+            return None
+        logger.debug(
+            f"Firmware for {config_hash} at {klipper_revision} found in {entry}"
+        )
+        return artifacts
+
+    def put(
+        self,
+        klipper_revision: str,
+        config_hash: str,
+        toolchain_hash: str,
+        artifacts: Collection[PathLike],
+    ) -> List[Path]:
+        """
+        Store the artifacts of a build, evicting old entries if needed
+        :return: The stored copies of the artifacts
+        """
+        key = artifact_key(klipper_revision, config_hash, toolchain_hash)
+        entry = self._entry(key)
+        entry.parent.mkdir(parents=True, exist_ok=True)
+        # Assemble the entry beside its final location, so it appears all at once
+        staging = Path(tempfile.mkdtemp(dir=entry.parent, prefix=f".{key[:16]}-"))
+        try:
+            for artifact in artifacts:
+                shutil.copyfile(artifact, staging / Path(artifact).name)
+            meta = {
+                "klipper_revision": klipper_revision,
+                "config_hash": config_hash,
+                "toolchain_hash": toolchain_hash,
+                "created": time.time(),
+                "artifacts": [Path(x).name for x in artifacts],
+            }
+            (staging / _META).write_text(json.dumps(meta))
+            shutil.rmtree(entry, ignore_errors=True)
+            os.replace(staging, entry)
+        except OSError:
+            shutil.rmtree(staging, ignore_errors=True)
+            raise
+        self.evict()
+        return [entry / Path(x).name for x in artifacts]
+
+    def _entries(self):
+        if not self.root.is_dir():
+            return
+        for parent in self.root.iterdir():
+            if not parent.is_dir():
+                continue
+            for entry in parent.iterdir():
+                if entry.is_dir() and not entry.name.startswith("."):
+                    yield entry
+
+    def evict(self, max_bytes: Optional[int] = None) -> int:
+        """
+        Remove the least recently used entries until the store fits in max_bytes (default: the store's limit)
+        :return: The number of entries removed
+        """
+        if max_bytes is None:
+            max_bytes = self.max_bytes
+        with self._lock:
+            return evict_lru(self._entries(), max_bytes)
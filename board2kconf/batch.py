@@ -0,0 +1,99 @@
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from fnmatch import fnmatchcase
+from os import PathLike
+from pathlib import Path
+from typing import Collection, Iterator, List, Optional, Tuple
+
+from .configurator import generate_config, shared_kconfig
+from .model import BoardDefinition
+
+logger = logging.getLogger(__name__)
+
+
+def match_boards(
+    boards: Collection[BoardDefinition], pattern: str
+) -> List[BoardDefinition]:
+    """
+    Return the boards whose manufacturer/model/variant matches a glob pattern (case-insensitive)
+    """
+    pattern = pattern.lower()
+    return [board for board in boards if fnmatchcase(str(board).lower(), pattern)]
+
+
+def _path_part(name: str) -> str:
+    return name.replace("/", "_")
+
+
+def config_path(out_dir: Path, board: BoardDefinition, interface: str) -> Path:
+    """
+    Where generate_all writes the config for a board and interface: <mfr>/<model>/<variant>/<iface>.config
+    """
+    return (
+        out_dir
+        / _path_part(board.manufacturer)
+        / _path_part(board.model)
+        / _path_part(board.variant)
+        / f"{interface.lower()}.config"
+    )
+
+
+def _generate_board(
+    klipper_path: Path,
+    board: BoardDefinition,
+    if_types: Optional[Collection[str]],
+    out_dir: Path,
+) -> List[Tuple[str, Path, Optional[str]]]:
+    results = []
+    for interface in board.interfaces:
+        if if_types is not None and interface.if_type not in if_types:
+            continue
+        path = config_path(out_dir, board, interface.if_type)
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            # Parsed once per process, each config starts from a clean copy of the same tree
+            generate_config(
+                klipper_path, board, interface, path, shared_kconfig(klipper_path)
+            )
+            results.append((interface.if_type, path, None))
+        except Exception as e:
+            results.append((interface.if_type, path, repr(e)))
+    return results
+
+
+def _generate_board_task(task):
+    return task[1], _generate_board(*task)
+
+
+def generate_all(
+    klipper_path: PathLike,
+    boards: Collection[BoardDefinition],
+    out_dir: PathLike,
+    if_types: Optional[Collection[str]] = None,
+    jobs: int = 1,
+) -> Iterator[Tuple[BoardDefinition, str, Path, Optional[str]]]:
+    """
+    Write a config for every given board and interface type under out_dir (see config_path).
+    Boards are spread over jobs processes, which write their configs as soon as they are generated.
+    :param if_types: Interface types (e.g. "USB") to generate, or None for every interface a board has
+    :return: (board, interface type, path, error or None) for each config, in board order
+    """
+    klipper_path = Path(klipper_path)
+    out_dir = Path(out_dir)
+    if if_types is not None:
+        if_types = {x.upper() for x in if_types}
+    tasks = [(klipper_path, board, if_types, out_dir) for board in boards]
+    if jobs > 1 and len(tasks) > 1:
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            for board, results in pool.map(
+                _generate_board_task,
+                tasks,
+                chunksize=max(1, len(tasks) // (jobs * 4)),
+            ):
+                for if_type, path, error in results:
+                    yield board, if_type, path, error
+    else:
+        for task in tasks:
+            board, results = _generate_board_task(task)
+            for if_type, path, error in results:
+                yield board, if_type, path, error
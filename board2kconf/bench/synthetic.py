@@ -0,0 +1,232 @@
+"""
+A synthetic, klipper-like source tree (just enough for kconfig) and a matching board database, for benchmarks.
+
+Architectures alternate between two styles found in klipper:
+ * "stm" style: upper-case processor models, a clock reference choice, and pins named in every comms option
+ * "rp" style: lower-case processor models, a flash chip choice, and generic CAN with separate gpio numbers
+"""
+
+from os import PathLike
+from pathlib import Path
+from typing import Dict, Tuple
+
+_TOP_KCONFIG = """\
+# Synthetic klipper Kconfig, generated by board2kconf.bench.synthetic
+mainmenu "Klipper Firmware Configuration"
+
+config LOW_LEVEL_OPTIONS
+    bool "Enable extra low-level configuration options"
+
+choice
+    prompt "Micro-controller Architecture"
+{arch_options}
+endchoice
+
+{arch_sources}
+
+config SERIAL
+    bool
+config CANSERIAL
+    bool
+config USBSERIAL
+    bool
+
+config SERIAL_BAUD
+    int "Baud rate for serial port" if LOW_LEVEL_OPTIONS && SERIAL
+    default 250000
+
+config CANBUS_FREQUENCY
+    int "CAN bus speed" if LOW_LEVEL_OPTIONS && CANSERIAL
+    default 1000000
+"""
+
+# A stand-in for klipper's Makefile: it honours OUT and KCONFIG_CONFIG in the same way, "compiling" an
+# object from the settings, and "linking" it into klipper.bin, so builds can be exercised without a toolchain
+_MAKEFILE = """\
+# Synthetic klipper Makefile, generated by board2kconf.bench.synthetic
+OUT=out/
+KCONFIG_CONFIG ?= .config
+
+all: $(OUT)klipper.bin
+
+$(OUT)klipper.o: $(KCONFIG_CONFIG)
+\t@mkdir -p $(OUT)
+\tgrep '^CONFIG_' $(KCONFIG_CONFIG) > $@
+
+$(OUT)klipper.bin: $(OUT)klipper.o
+\tcp $< $@
+
+.PHONY: all
+"""
+
+_CLOCKS = (8, 12, 16, 25)
+
+
+def arch_name(arch: int) -> str:
+    return f"Synthetic Arch {arch:03d}"
+
+
+def mcu_name(arch: int, mcu: int) -> str:
+    if arch % 2:
+        return f"syn{arch}rp{mcu}"
+    return f"SYN{arch}F{mcu:03d}"
+
+
+def board_key(arch: int, mcu: int) -> Tuple[str, str, str]:
+    """
+    The manufacturer, model and variant of the synthetic board for an MCU
+    """
+    return f"Synthetic {arch}", f"Board {mcu}", f"Board {mcu} v1"
+
+
+def _config(name: str, prompt: str, extra: str = "") -> str:
+    return f'    config {name}\n        bool "{prompt}"\n{extra}'
+
+
+def _stm_kconfig(arch: int, mcus: int, comms: int) -> str:
+    prefix = f"ARCH{arch}"
+    models = "".join(
+        _config(f"{prefix}_MCU{m}", mcu_name(arch, m)) for m in range(mcus)
+    )
+    mcu_defaults = "".join(
+        f'    default "{mcu_name(arch, m).lower()}" if {prefix}_MCU{m}\n'
+        for m in range(mcus)
+    )
+    clocks = "".join(
+        _config(f"{prefix}_CLOCK_REF_{c}M", f"{c} MHz crystal") for c in _CLOCKS
+    ) + _config(f"{prefix}_CLOCK_REF_INTERNAL", "Internal clock")
+    comms_options = _config(
+        f"{prefix}_USB_PA11_PA12", "USB (on PA11/PA12)", "        select USBSERIAL\n"
+    )
+    for c in range(comms):
+        comms_options += _config(
+            f"{prefix}_SERIAL_USART{c}",
+            f"Serial (on USART{c} PC{2 * c + 1}/PC{2 * c})",
+            "        select SERIAL\n",
+        )
+        comms_options += _config(
+            f"{prefix}_CANBUS_PB{2 * c}_PB{2 * c + 1}",
+            f"CAN bus (on PB{2 * c}/PB{2 * c + 1})",
+            "        select CANSERIAL\n",
+        )
+    comms_options += _config(
+        f"{prefix}_USBCANBUS_PA11_PA12",
+        "USB to CAN bus bridge (USB on PA11/PA12)",
+        "        select USBSERIAL\n        select CANSERIAL\n",
+    )
+    return (
+        f"if MACH_{prefix}\n"
+        f'config BOARD_DIRECTORY\n    string\n    default "arch{arch}"\n'
+        f'choice\n    prompt "Processor model"\n{models}endchoice\n'
+        f"config MCU\n    string\n{mcu_defaults}"
+        f'choice\n    prompt "Clock Reference" if LOW_LEVEL_OPTIONS\n{clocks}endchoice\n'
+        f'choice\n    prompt "Communication interface"\n{comms_options}endchoice\n'
+        "endif\n"
+    )
+
+
+def _rp_kconfig(arch: int, mcus: int, comms: int) -> str:
+    prefix = f"ARCH{arch}"
+    models = "".join(
+        _config(f"{prefix}_MCU{m}", mcu_name(arch, m)) for m in range(mcus)
+    )
+    mcu_defaults = "".join(
+        f'    default "{mcu_name(arch, m)}" if {prefix}_MCU{m}\n' for m in range(mcus)
+    )
+    flash = _config(f"{prefix}_FLASH_W25Q080", "W25Q080 with CLKDIV 2") + _config(
+        f"{prefix}_FLASH_GENERIC_03H", "GENERIC_03H with CLKDIV 4"
+    )
+    comms_options = _config(f"{prefix}_USB", "USBSERIAL", "        select USBSERIAL\n")
+    for c in range(comms):
+        comms_options += _config(
+            f"{prefix}_SERIAL_UART{c}",
+            f"UART{c} on GPIO{2 * c}/GPIO{2 * c + 1}",
+            "        select SERIAL\n",
+        )
+    comms_options += _config(
+        f"{prefix}_CANBUS", "CAN bus", "        select CANSERIAL\n"
+    ) + _config(
+        f"{prefix}_USBCANBUS",
+        "USB to CAN bus bridge",
+        "        select USBSERIAL\n        select CANSERIAL\n",
+    )
+    return (
+        f"if MACH_{prefix}\n"
+        f'config BOARD_DIRECTORY\n    string\n    default "arch{arch}"\n'
+        f'choice\n    prompt "Processor model"\n{models}endchoice\n'
+        f"config MCU\n    string\n{mcu_defaults}"
+        f'choice\n    prompt "Flash chip" if LOW_LEVEL_OPTIONS\n{flash}endchoice\n'
+        f'choice\n    prompt "Communication interface"\n{comms_options}endchoice\n'
+        f"config {prefix}_CANBUS_GPIO_RX\n"
+        f'    int "CAN RX gpio number" if {prefix}_CANBUS || {prefix}_USBCANBUS\n'
+        "    default 4\n"
+        f"config {prefix}_CANBUS_GPIO_TX\n"
+        f'    int "CAN TX gpio number" if {prefix}_CANBUS || {prefix}_USBCANBUS\n'
+        "    default 5\n"
+        "endif\n"
+    )
+
+
+def write_klipper_tree(path: PathLike, archs: int, mcus: int, comms: int) -> Path:
+    """
+    Write a synthetic klipper tree with the given number of architectures, MCUs per architecture,
+    and serial/CAN options per architecture, along with a stand-in Makefile.
+    """
+    path = Path(path)
+    arch_options = "".join(
+        _config(f"MACH_ARCH{a}", arch_name(a)) for a in range(archs)
+    ).rstrip("\n")
+    arch_sources = "\n".join(f'source "src/arch{a}/Kconfig"' for a in range(archs))
+    (path / "src").mkdir(parents=True, exist_ok=True)
+    (path / "Makefile").write_text(_MAKEFILE)
+    (path / "src" / "Kconfig").write_text(
+        _TOP_KCONFIG.format(arch_options=arch_options, arch_sources=arch_sources)
+    )
+    for a in range(archs):
+        (path / "src" / f"arch{a}").mkdir(exist_ok=True)
+        kconfig = _rp_kconfig if a % 2 else _stm_kconfig
+        (path / "src" / f"arch{a}" / "Kconfig").write_text(kconfig(a, mcus, comms))
+    return path
+
+
+def synthetic_boards(archs: int, mcus: int, comms: int) -> Dict:
+    """
+    Return a board database (as loaded from JSON) with a board for every MCU of a synthetic tree
+    """
+    manufacturers = {}
+    for a in range(archs):
+        for m in range(mcus):
+            manufacturer, model, variant = board_key(a, m)
+            c = m % comms if comms else None
+            if a % 2:
+                definition = {
+                    "mcu": {
+                        "architecture": arch_name(a),
+                        "mcu": mcu_name(a, m),
+                        "flash": "w25q080",
+                    },
+                    "usb": {},
+                    "can": {"can_rx": "gpio4", "can_tx": "gpio5"},
+                }
+                if c is not None:
+                    definition["rs232"] = {
+                        "tx": f"gpio{2 * c}",
+                        "rx": f"gpio{2 * c + 1}",
+                    }
+            else:
+                definition = {
+                    "mcu": {
+                        "architecture": arch_name(a),
+                        "mcu": mcu_name(a, m),
+                        "clock": f"{_CLOCKS[m % len(_CLOCKS)]}MHz",
+                    },
+                    "usb": "PA11/PA12",
+                }
+                if c is not None:
+                    definition["can"] = f"PB{2 * c}/PB{2 * c + 1}"
+                    definition["uart"] = {
+                        "tx_pin": f"PC{2 * c}",
+                        "rx_pin": f"PC{2 * c + 1}",
+                    }
+            manufacturers.setdefault(manufacturer, {})[model] = {variant: definition}
+    return {"Synthetic Boards": manufacturers}
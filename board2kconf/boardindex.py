@@ -0,0 +1,71 @@
+"""
+A precompiled form of the board database.
+
+The index holds already validated board entries, the manufacturer/model/variant hierarchy and the search and hardware
+indexes, marshalled with all strings interned, so it loads without parsing JSON or rebuilding anything. Build it with
+`build_kboard_index`.
+
+The same format holds the search and hardware indexes of a database loaded from JSON, cached against its content.
+"""
+
+import logging
+import marshal
+import struct
+import sys
+from os import PathLike
+from pathlib import Path
+from typing import Any, Optional, Set
+
+from .util import write_atomic
+
+logger = logging.getLogger(__name__)
+
+_MAGIC = b"EZFBIDX"
+# Bump this whenever the layout of the payload changes
+_FORMAT = 3
+# magic, format, marshal version
+_HEADER = struct.Struct("<7sBI")
+_PAYLOAD_KEYS = {"entries", "index", "duplicates", "hardware", "search"}
+
+
+def _intern(value: Any) -> Any:
+    # Interned strings are written once, and referenced after that
+    if isinstance(value, str):
+        return sys.intern(value)
+    elif isinstance(value, dict):
+        return {_intern(k): _intern(v) for k, v in value.items()}
+    elif isinstance(value, (list, tuple, set)):
+        return type(value)(_intern(x) for x in value)
+    return value
+
+
+def dump_index(path: PathLike, payload: Any):
+    data = _HEADER.pack(_MAGIC, _FORMAT, marshal.version) + marshal.dumps(
+        _intern(payload), marshal.version
+    )
+    write_atomic(path, data)
+
+
+def load_index(path: PathLike, keys: Optional[Set[str]] = _PAYLOAD_KEYS) -> Any:
+    """
+    Return the payload of an index, or None if it is unreadable or from an incompatible version
+    :param keys: The keys a precompiled board database has, or None for any payload
+    """
+    try:
+        data = Path(path).read_bytes()
+    except OSError:
+        return None
+    if len(data) < _HEADER.size:
+        return None
+    magic, fmt, marshal_version = _HEADER.unpack_from(data)
+    if magic != _MAGIC or fmt != _FORMAT or marshal_version > marshal.version:
+        logger.debug(f"Ignoring incompatible board index {path}")
+        return None
+    try:
+        payload = marshal.loads(memoryview(data)[_HEADER.size :])
+    except (EOFError, ValueError, TypeError):
+        logger.debug(f"Ignoring corrupt board index {path}")
+        return None
+    if keys is not None and (not isinstance(payload, dict) or set(payload) != keys):
+        return None
+    return payload
@@ -0,0 +1,254 @@
+import dataclasses
+import hashlib
+import json
+import logging
+import os
+import shlex
+import shutil
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from os import PathLike
+from pathlib import Path
+from typing import Collection, Dict, Iterator, List, Optional, Tuple
+
+from .artifacts import ArtifactStore, evict_lru
+from .batch import generate_all
+from .model import BoardDefinition
+from .util import git_is_clean, git_revision, normalise_config
+
+logger = logging.getLogger(__name__)
+
+# Everything a klipper build may leave in OUT that is worth flashing, depending on the arch
+ARTIFACTS = ("klipper.bin", "klipper.uf2", "klipper.elf.hex")
+# Environment variables that choose (or configure) the toolchain klipper's Makefile builds with
+TOOLCHAIN_ENV = (
+    "PATH",
+    "CROSS_PREFIX",
+    "CC",
+    "AS",
+    "LD",
+    "OBJCOPY",
+    "OBJDUMP",
+    "STRIP",
+    "CPP",
+    "CFLAGS",
+    "LDFLAGS",
+    "PYTHON",
+    "MAKEFLAGS",
+)
+
+
+def config_hash(path: PathLike) -> str:
+    return hashlib.sha256(normalise_config(path).encode("utf-8")).hexdigest()
+
+
+def toolchain_hash(make: str) -> str:
+    """
+    Hash what, besides klipper and the config, decides what a build produces: the make command (which may
+    set variables such as CROSS_PREFIX) and the TOOLCHAIN_ENV variables
+    """
+    return hashlib.sha256(
+        json.dumps(
+            [shlex.split(make), {x: os.environ.get(x) for x in TOOLCHAIN_ENV}]
+        ).encode("utf-8")
+    ).hexdigest()
+
+
+def build_dir_name(klipper_path: PathLike, toolchain: str, digest: str) -> str:
+    """
+    Name the build directory for a config (by its config_hash), built by a klipper checkout with a toolchain
+    (by its toolchain_hash). Make tracks neither the compiler nor which checkout $(OUT)board links into, so
+    the objects in a build directory are only reusable by the checkout and toolchain that compiled them.
+    """
+    return hashlib.sha256(
+        f"{Path(klipper_path).absolute()}:{toolchain}:{digest}".encode("utf-8")
+    ).hexdigest()[:16]
+
+
+def artifact_dir(config_path: PathLike) -> Path:
+    """
+    Where the firmware built from a config is copied: next to it, named after it (usb.config -> usb/)
+    """
+    return Path(config_path).with_suffix("")
+
+
+@dataclasses.dataclass
+class BuildResult(object):
+    config_hash: str
+    build_dir: Path
+    artifacts: List[Path]
+    error: Optional[str] = None
+    # Whether the artifacts came from the store, without running make
+    cached: bool = False
+
+
+def run_make(
+    klipper_path: PathLike,
+    config_path: PathLike,
+    build_dir: PathLike,
+    make: str = "make",
+    make_jobs: int = 1,
+) -> BuildResult:
+    """
+    Build klipper out-of-tree for one config. The config is copied into build_dir, which make uses as OUT,
+    so re-running for the same config only rebuilds what changed in klipper.
+    :param make: The make command, may include arguments (e.g. a CROSS_PREFIX)
+    """
+    build_dir = Path(build_dir).absolute()
+    build_dir.mkdir(parents=True, exist_ok=True)
+    digest = config_hash(config_path)
+    klipper_path = Path(klipper_path).absolute()
+    build_config = build_dir / ".config"
+    # make may rewrite its config (olddefconfig), only replace it if the settings differ,
+    # otherwise the newer mtime would force a full rebuild
+    if not build_config.exists() or config_hash(build_config) != digest:
+        shutil.copyfile(config_path, build_config)
+    command = [
+        *shlex.split(make),
+        "-C",
+        str(klipper_path),
+        f"OUT={build_dir}/",
+        f"KCONFIG_CONFIG={build_config}",
+        f"-j{make_jobs}",
+    ]
+    logger.debug(f"Building {config_path} in {build_dir}: {shlex.join(command)}")
+    try:
+        with open(build_dir / "build.log", "wb") as log:
+            # klipper's Makefile takes paths (such as the $(OUT)board link) from $(PWD), which make -C does not update
+            process = subprocess.run(
+                command,
+                cwd=klipper_path,
+                env={**os.environ, "PWD": str(klipper_path)},
+                stdout=log,
+                stderr=subprocess.STDOUT,
+            )
+    except OSError as e:
+        # e.g. --make names a command that does not exist
+        return BuildResult(digest, build_dir, [], f"Could not run {command[0]}: {e}")
+    artifacts = [build_dir / x for x in ARTIFACTS if (build_dir / x).exists()]
+    if process.returncode != 0:
+        return BuildResult(
+            digest,
+            build_dir,
+            [],
+            f"make exited with {process.returncode}, see {build_dir / 'build.log'}",
+        )
+    if not artifacts:
+        return BuildResult(digest, build_dir, [], "make did not produce any firmware")
+    return BuildResult(digest, build_dir, artifacts)
+
+
+def build_configs(
+    klipper_path: PathLike,
+    config_paths: Collection[PathLike],
+    build_root: PathLike,
+    make: str = "make",
+    jobs: int = 1,
+    make_jobs: int = 1,
+    store: Optional[ArtifactStore] = None,
+    build_root_max_bytes: Optional[int] = None,
+) -> Iterator[Tuple[Path, BuildResult]]:
+    """
+    Build firmware for each config, and copy it into the config's artifact_dir.
+    Configs with the same settings share a build directory under build_root (see build_dir_name), so they are
+    built once, and later builds of them with the same klipper checkout and toolchain reuse the compiled objects.
+    :param jobs: Number of builds to run at once
+    :param make_jobs: Number of jobs each make runs with
+    :param store: Where to look for firmware already built from the same klipper commit, settings and toolchain
+                  (skipping make entirely), and to keep new builds
+    :param build_root_max_bytes: Evict the least recently used build directories once build_root outgrows this.
+                                 Those used by this call are kept.
+    :return: (config path, result) for each config, in the order given
+    """
+    klipper_path = Path(klipper_path).absolute()
+    build_root = Path(build_root)
+    groups: Dict[str, List[Path]] = {}
+    for path in config_paths:
+        groups.setdefault(config_hash(path), []).append(Path(path))
+    logger.info(f"Building {len(groups)} firmwares for {len(config_paths)} configs")
+
+    revision = None
+    toolchain = toolchain_hash(make)
+    if store is not None:
+        if git_is_clean(klipper_path):
+            revision = git_revision(klipper_path)
+        else:
+            # The commit alone does not identify what would be built
+            logger.warning(
+                f"{klipper_path} has uncommitted changes, not using the firmware store"
+            )
+
+    def build(digest: str) -> BuildResult:
+        build_dir = build_root / build_dir_name(klipper_path, toolchain, digest)
+        if revision and (artifacts := store.get(revision, digest, toolchain)):
+            return BuildResult(digest, build_dir, artifacts, cached=True)
+        result = run_make(klipper_path, groups[digest][0], build_dir, make, make_jobs)
+        try:
+            # A no-op rebuild changes nothing in the directory, mark it as used for eviction
+            os.utime(build_dir)
+        except OSError:
+            pass
+        if revision and result.error is None:
+            try:
+                store.put(revision, digest, toolchain, result.artifacts)
+            except OSError as e:
+                logger.warning(f"Could not store firmware from {build_dir}: {e}")
+        return result
+
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as pool:
+        results = dict(zip(groups, pool.map(build, groups)))
+    if build_root_max_bytes is not None:
+        evict_lru(
+            (x for x in build_root.iterdir() if x.is_dir()),
+            build_root_max_bytes,
+            keep={x.build_dir for x in results.values()},
+        )
+    for path in config_paths:
+        path = Path(path)
+        result = results[config_hash(path)]
+        if result.error is None:
+            out = artifact_dir(path)
+            out.mkdir(parents=True, exist_ok=True)
+            for artifact in result.artifacts:
+                shutil.copyfile(artifact, out / artifact.name)
+        yield path, result
+
+
+def build_all(
+    klipper_path: PathLike,
+    boards: Collection[BoardDefinition],
+    out_dir: PathLike,
+    build_root: PathLike,
+    if_types: Optional[Collection[str]] = None,
+    make: str = "make",
+    jobs: int = 1,
+    make_jobs: int = 1,
+    store: Optional[ArtifactStore] = None,
+    build_root_max_bytes: Optional[int] = None,
+) -> Iterator[Tuple[BoardDefinition, str, Path, Optional[BuildResult], Optional[str]]]:
+    """
+    Write configs for the given boards (see generate_all), then build firmware for each of them (see build_configs)
+    :return: (board, interface type, config path, build result, error or None) for each config.
+             Configs that could not be generated come first (without a build result), then the rest in
+             board order as they are built.
+    """
+    configs = []
+    for board, if_type, path, error in generate_all(
+        klipper_path, boards, out_dir, if_types, jobs
+    ):
+        if error:
+            yield board, if_type, path, None, error
+        else:
+            configs.append((board, if_type, path))
+    built = build_configs(
+        klipper_path,
+        [x[2] for x in configs],
+        build_root,
+        make,
+        jobs,
+        make_jobs,
+        store,
+        build_root_max_bytes,
+    )
+    for (board, if_type, _), (path, result) in zip(configs, built):
+        yield board, if_type, path, result, result.error
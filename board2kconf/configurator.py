@@ -1,13 +1,27 @@
+import dataclasses
 import re
+import hashlib
+import json
 import logging
+import shutil
 from datetime import datetime
+from functools import cache
 from os import PathLike
 from pathlib import Path
-from typing import Optional
+from typing import Optional, List, Tuple, Any, Dict
 
-from .kconfig import KConfig, KConfigChoice
+from .kconfig import KConfig, KConfigChoice, cached_kconfig_fingerprint
 from .model import BoardDefinition, BoardInterfaceDefinition
-from .util import table_munge
+from .prompts import freq_key
+from .trace import span
+from .util import (
+    atomic_write,
+    code_fingerprint,
+    get_cache_dir,
+    normalise_config,
+    table_munge,
+    write_atomic,
+)
 
 logger = logging.getLogger(__name__)
 FREQ_IN_RE = re.compile("([0-9]+)([MK]hz)", flags=re.IGNORECASE)
@@ -19,18 +33,187 @@ _ARCH_MUNGES = (
 _PROMPT_MUNGES = (("Communication interface", "Communications interface"),)
 
 
+@cache
+def shared_kconfig(klipper_path: PathLike) -> KConfig:
+    """
+    Return a parsed tree for klipper_path, shared with everything else in this process that asks for it.
+    Configurators reset the tree they are given, so only one may use it at a time.
+    """
+    return KConfig(klipper_path)
+
+
+class _PlanStore(object):
+    """
+    Assignments the configurator resolved for a set of inputs, against one klipper kconfig tree.
+    Plans are kept on disk, so later runs can make the same assignments without searching for them.
+    """
+
+    def __init__(self, fingerprint: str):
+        self._plans: Dict[str, List[Tuple[str, Any]]] = {}
+        self._path = None
+        if cache_dir := get_cache_dir("plans"):
+            # Plans are only valid for the tree, and the configurator logic, that produced them
+            key = hashlib.sha256(
+                f"{fingerprint}:{code_fingerprint()}".encode("utf-8")
+            ).hexdigest()
+            self._path = cache_dir / f"{key}.json"
+            self._plans = self._read()
+
+    def _read(self) -> Dict[str, List[Tuple[str, Any]]]:
+        try:
+            return json.loads(self._path.read_text())
+        except (OSError, ValueError):
+            return {}
+
+    def get(self, key: str) -> Optional[List[Tuple[str, Any]]]:
+        return self._plans.get(key)
+
+    def record(self, key: str, plan: List[Tuple[str, Any]]):
+        self._plans[key] = plan
+        if not self._path:
+            return
+        # Other processes may have recorded plans since we read ours
+        plans = self._read()
+        plans.update(self._plans)
+        self._plans = plans
+        try:
+            write_atomic(self._path, json.dumps(plans))
+        except OSError as e:
+            logger.debug(f"Could not save configuration plans: {e!r}")
+
+
+@cache
+def _plan_store(fingerprint: str) -> _PlanStore:
+    return _PlanStore(fingerprint)
+
+
+@dataclasses.dataclass(frozen=True)
+class GeneratedConfig(object):
+    # The config came from the cache, without running the configurator
+    cached: bool
+    # config_path was (re)written, False if skip_unchanged found it already had the same settings
+    written: bool
+
+
+def generate_config(
+    klipper_path: PathLike,
+    board: BoardDefinition,
+    interface: BoardInterfaceDefinition,
+    config_path: PathLike,
+    kconfig: Optional[KConfig] = None,
+    skip_unchanged: bool = False,
+) -> GeneratedConfig:
+    """
+    Write the .config for a board and interface to config_path.
+    Configs are cached by the board, interface, klipper kconfig and ezflash itself, so repeat requests skip the
+    configurator entirely.
+    :param kconfig: An already parsed tree for klipper_path to use if the config has to be generated
+    :param skip_unchanged: Leave an existing config_path alone if it already has the same settings (see
+                           Configurator.save_config)
+    """
+    config_path = Path(config_path)
+    fingerprint = (
+        kconfig.fingerprint if kconfig else cached_kconfig_fingerprint(klipper_path)
+    )
+    if fingerprint is None:
+        # Nothing cached to take the fingerprint from, so parse the tree once and generate from it too
+        kconfig = KConfig(klipper_path)
+        fingerprint = kconfig.fingerprint
+    key = hashlib.sha256(
+        json.dumps(
+            [
+                code_fingerprint(),
+                fingerprint,
+                board.content_hash(),
+                interface.content_hash(),
+            ]
+        ).encode("utf-8")
+    ).hexdigest()
+    cache_dir = get_cache_dir("configs")
+    cached_path = cache_dir / f"{key}.config" if cache_dir else None
+    if cached_path and cached_path.exists():
+        logger.debug(f"Using cached config for {board}/{interface}")
+        # Cached configs are written by the same tree, so comparing their settings line by line is enough
+        if (
+            skip_unchanged
+            and config_path.exists()
+            and normalise_config(config_path) == normalise_config(cached_path)
+        ):
+            logger.debug(f"No change to {config_path}")
+            return GeneratedConfig(cached=True, written=False)
+        shutil.copyfile(cached_path, config_path)
+        return GeneratedConfig(cached=True, written=True)
+
+    config = Configurator(klipper_path, board, kconfig)
+    config.set_interface(interface)
+    written = config.save_config(config_path, skip_unchanged)
+    if cached_path:
+        with atomic_write(cached_path) as tmp_path:
+            if written:
+                shutil.copyfile(config_path, tmp_path)
+            else:
+                # config_path is still the caller's own file, only ever cache what the configurator wrote
+                config.save_config(tmp_path)
+    return GeneratedConfig(cached=False, written=written)
+
+
 class Configurator(object):
-    def __init__(self, klipper_path: PathLike, board: BoardDefinition):
+    def __init__(
+        self,
+        klipper_path: PathLike,
+        board: BoardDefinition,
+        kconfig: Optional[KConfig] = None,
+    ):
+        """
+        :param kconfig: An already parsed tree for klipper_path to reuse. Any selections on it are discarded.
+        """
         self.klipper_path = klipper_path
-        self.kconfig = KConfig(klipper_path)
+        self.kconfig = kconfig if kconfig is not None else KConfig(klipper_path)
         self._board = board
+        self.reset()
+
+    @span()
+    def reset(self, board: Optional[BoardDefinition] = None):
+        """
+        Discard all selections, and start over for the given board (or the current one)
+        """
+        if board is not None:
+            self._board = board
+        self.kconfig.reset()
         # We always set the below, because tons of stuff is missing otherwise
         self.kconfig.symbol(prompt="Enable extra low-level configuration options").set(
             True
         )
-        self._load_from_board(board)
+        self._load_from_board(self._board)
+
+    def _run_planned(self, inputs: List, search, *args):
+        """
+        Make the selections for the given inputs by replaying the plan recorded for them, if there is one.
+        Otherwise (or if the plan no longer applies) run search(*args), and record what it selected.
+        """
+        plans = _plan_store(self.kconfig.fingerprint)
+        key = json.dumps(inputs)
+        if (plan := plans.get(key)) is not None:
+            state = self.kconfig.snapshot()
+            if self.kconfig.replay(plan):
+                logger.debug(f"Replayed plan for {key}")
+                return
+            logger.debug(f"Plan for {key} did not apply, searching instead")
+            self.kconfig.restore(state)
+        start = len(self.kconfig.assignments)
+        search(*args)
+        plans.record(key, self.kconfig.assignments[start:])
 
     def _load_from_board(self, board):
+        mcu = board.mcu
+        self._run_planned(
+            ["board", mcu.arch, mcu.mcu, mcu.clock, mcu.flash],
+            self._search_board,
+            board,
+        )
+
+    @span()
+    def _search_board(self, board):
         self.set_arch(board.mcu.arch)
         self.set_mcu(board.mcu.mcu)
         if clock := board.mcu.clock:
@@ -40,21 +223,19 @@ class Configurator(object):
         if flash := board.mcu.flash:
             self.set_flash(flash)
 
+    @span()
     def set_arch(self, arch):
         # Despite what the below says, we have to deal with differeing titles for some arches
         arch = table_munge(arch, _ARCH_MUNGES)
         # Arch is pretty easy to deal with, since it is always the same prompt, but the choice is unnamed
         self.kconfig.choice(prompt="Micro-controller Architecture").select(prompt=arch)
 
+    @span()
     def set_mcu(self, mcu):
         if proc_choice := self.kconfig.choice(prompt="Processor model"):
-            for possible_mcu in proc_choice.choices():
-                mcu_prompt = possible_mcu.nodes[0].prompt[0].split(" ")[0]
-                if mcu_prompt == mcu:
-                    logger.debug(
-                        f"Selected {possible_mcu!r} for MCU specification {mcu}"
-                    )
-                    possible_mcu.set_value(2)
+            for possible_mcu in proc_choice.prompt_index().mcus.get(mcu, ()):
+                logger.debug(f"Selected {possible_mcu!r} for MCU specification {mcu}")
+                self.kconfig.assign(possible_mcu, 2)
         else:
             # This arch doesn't support setting the MCU
             if not mcu:
@@ -69,12 +250,14 @@ class Configurator(object):
                 f"Could not set MCU type to {mcu}. Is it supported by this version of klipper?"
             )
 
+    @span()
     def set_freq(self, freq):
-        freq_choice: Optional[KConfigChoice] = None
-        for choice in self.kconfig.choices:
-            if choice.prompt in ["Processor Speed", "Clock Reference"]:
-                freq_choice = choice
-                break
+        try:
+            freq_choice: Optional[KConfigChoice] = self.kconfig.choice(
+                prompt=("Processor Speed", "Clock Reference")
+            )
+        except KeyError:
+            freq_choice = None
         if (not freq_choice) and freq:
             raise ValueError("Frequency cannot be set for this MCU")
         # Special case "INTERNAL"
@@ -87,30 +270,31 @@ class Configurator(object):
             rate, units = matches.groups()
         else:
             raise ValueError(f'Frequency "{freq}" not recognized')
-        target_re = re.compile(
-            f"^{re.escape(rate)} ?{re.escape(units)}", flags=re.IGNORECASE
-        )
-        for sym in freq_choice.choices():
-            if target_re.match(sym.nodes[0].prompt[0]):
-                logger.debug(f"Selected {sym!r} for clock specification {freq}")
-                sym.set_value(2)
-                return
-        raise ValueError(f"Could not set frequency to {freq}")
+        sym = freq_choice.prompt_index().freqs.get(freq_key(rate, units))
+        if not freq_choice.select_option(sym):
+            raise ValueError(f"Could not set frequency to {freq}")
+        logger.debug(f"Selected {sym!r} for clock specification {freq}")
 
+    @span()
     def set_flash(self, flash):
         if flash_choice := self.kconfig.choice(prompt="Flash chip"):
-            for possible_flash in flash_choice.choices():
-                if possible_flash.nodes[0].prompt[0].lower().startswith(flash.lower()):
-                    logger.debug(
-                        f"Selected {possible_flash!r} for flash specification {flash}"
-                    )
-                    possible_flash.set_value(2)
-                    return
+            possible_flash = flash_choice.prompt_index().flash(flash)
+            if flash_choice.select_option(possible_flash):
+                logger.debug(
+                    f"Selected {possible_flash!r} for flash specification {flash}"
+                )
+                return
             raise ValueError(
                 f"Could not select flash {flash}, is it supported by this version of klipper?"
             )
         raise RuntimeError(f"This MCU does not support setting the flash type")
 
+    def kconfig_files(self):
+        """
+        Return the klipper kconfig files (relative to the checkout) that the current selections depend on
+        """
+        return self.kconfig.active_files()
+
     def get_interfaces(self):
         return self._board.interfaces
 
@@ -143,6 +327,7 @@ class Configurator(object):
                 return True
         return False
 
+    @span()
     def set_canbridge(
         self,
         can_interface: BoardInterfaceDefinition,
@@ -150,14 +335,33 @@ class Configurator(object):
     ):
         raise NotImplementedError("Canbridge is not yet supported")
 
+    @span()
     def set_interface(self, interface: BoardInterfaceDefinition):
+        mcu = self._board.mcu
+        self._run_planned(
+            [
+                "interface",
+                mcu.arch,
+                mcu.mcu,
+                mcu.clock,
+                mcu.flash,
+                interface.if_type,
+                sorted(interface.pins.items()),
+            ],
+            self._search_interface,
+            interface,
+        )
+
+    @span()
+    def _search_interface(self, interface: BoardInterfaceDefinition):
         if interface.if_type == "USB":
             if not interface.pins:
                 self._get_comms_choice().select(prompt=("USB", "USBSERIAL"))
             else:
-                self._get_comms_choice().select(
-                    prompt=f"USB (on {interface.pins['dm']}/{interface.pins['dp']})"
-                )
+                comms = self._get_comms_choice()
+                pins = (interface.pins["dm"], interface.pins["dp"])
+                if not comms.select_option(comms.prompt_index().usb.get(pins)):
+                    comms.select(prompt=f"USB (on {pins[0]}/{pins[1]})")
         elif interface.if_type == "CAN":
             if "CAN bus" in self._get_comms_choice().prompts():
                 self._get_comms_choice().select(prompt="CAN bus")
@@ -171,25 +375,21 @@ class Configurator(object):
                         "Generic can bus comms specified, but pin configurations could not be found"
                     )
             else:
-                self._get_comms_choice().select(
-                    prompt=f"CAN bus (on {interface.pins['rx']}/{interface.pins['tx']})"
-                )
+                comms = self._get_comms_choice()
+                pins = (interface.pins["rx"], interface.pins["tx"])
+                if not comms.select_option(comms.prompt_index().can.get(pins)):
+                    comms.select(prompt=f"CAN bus (on {pins[0]}/{pins[1]})")
         elif interface.if_type == "UART":
-            pin_spec = (
-                f"({interface.pins['rx'].upper()}/{interface.pins['tx'].upper()}|"
-                f"{interface.pins['tx'].upper()}/{interface.pins['rx'].upper()})"
-            )
-            target_re = re.compile(
-                f"^(Serial \\(?on )?US?ART[0-9]* (on )?{pin_spec}\\)?"
+            comms = self._get_comms_choice()
+            pins = frozenset(
+                (interface.pins["rx"].upper(), interface.pins["tx"].upper())
             )
-            for possible_comms in self._get_comms_choice().choices():
-                if target_re.match(possible_comms.nodes[0].prompt[0]):
-                    possible_comms.set_value(2)
-                    return
-            raise ValueError(f"Serial not found {interface!r}")
+            if not comms.select_option(comms.prompt_index().uart.get(pins)):
+                raise ValueError(f"Serial not found {interface!r}")
         else:
             raise ValueError(f"Interface type {interface.if_type} is not supported")
 
+    @span()
     def set_baud(self, baud):
         """
         Set the baud rate of whatever interface is currently configured.
@@ -210,7 +410,21 @@ class Configurator(object):
             "#\n"
         )
 
-    def save_config(self, config_path: PathLike):
+    @span()
+    def save_config(self, config_path: PathLike, skip_unchanged: bool = False) -> bool:
+        """
+        :param skip_unchanged: Leave an existing config_path alone if loading it gives the same settings as the
+                               current ones. Rewriting it (if only to update the header) makes klipper's make
+                               rebuild everything.
+        :return: Whether config_path was written
+        """
+        config_path = Path(config_path)
+        if skip_unchanged and config_path.exists():
+            if not (changes := self.kconfig.config_changes(config_path)):
+                logger.debug(f"No change to {config_path}")
+                return False
+            logger.debug(f"{config_path} differs in {sorted(changes)}")
         self.kconfig.kcl.write_config(
-            str(Path(config_path).absolute()), header=self._header(), save_old=False
+            str(config_path.absolute()), header=self._header(), save_old=False
         )
+        return True
@@ -0,0 +1,239 @@
+"""
+A long running configuration service, keeping the board database and a parsed klipper Kconfig tree warm.
+
+Requests and responses are JSON-RPC 2.0, one JSON object per line, over a Unix socket:
+ * list_boards(filter="*"): The boards matching a manufacturer/model/variant glob
+ * describe_board(board): Everything the database says about a board
+ * generate_config(board, interface, path=None, skip_unchanged=False): Write the .config for a board and
+   interface to path (left alone if skip_unchanged and it already has the same settings), or return its contents
+   if no path is given
+"""
+
+import asyncio
+import json
+import logging
+import os
+import signal
+import socket
+import tempfile
+from os import PathLike
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+from .batch import match_boards
+from .configurator import generate_config, shared_kconfig
+from .model import BoardDatabase
+
+logger = logging.getLogger(__name__)
+
+# Standard JSON-RPC error codes
+PARSE_ERROR = -32700
+INVALID_REQUEST = -32600
+METHOD_NOT_FOUND = -32601
+INVALID_PARAMS = -32602
+# Application errors, such as an unknown board
+REQUEST_FAILED = -32000
+
+
+def default_socket_path() -> Path:
+    if runtime_dir := os.environ.get("XDG_RUNTIME_DIR"):
+        return Path(runtime_dir) / "ezflash.sock"
+    return Path(tempfile.gettempdir()) / f"ezflash-{os.getuid()}.sock"
+
+
+class RPCError(Exception):
+    def __init__(self, code: int, message: str):
+        super().__init__(message)
+        self.code = code
+        self.message = message
+
+
+class ConfigDaemon(object):
+    def __init__(self, klipper_path: PathLike):
+        self.klipper_path = Path(klipper_path)
+        self.boards = BoardDatabase(lazy=True)
+        self.kconfig = shared_kconfig(self.klipper_path)
+        # The tree is shared by every request, only one may use it at a time
+        self._kconfig_lock = asyncio.Lock()
+        self._methods = {
+            "list_boards": self.list_boards,
+            "describe_board": self.describe_board,
+            "generate_config": self.generate_config,
+        }
+
+    async def list_boards(self, filter: str = "*"):
+        return [
+            board.as_dict() for board in match_boards(self.boards.get_all(), filter)
+        ]
+
+    async def describe_board(self, board: str):
+        return self.boards.find(board).as_dict()
+
+    async def generate_config(
+        self,
+        board: str,
+        interface: str,
+        path: Optional[str] = None,
+        skip_unchanged: bool = False,
+    ):
+        board_def = self.boards.find(board)
+        interface_def = board_def.interface(interface)
+        async with self._kconfig_lock:
+            return await asyncio.get_running_loop().run_in_executor(
+                None,
+                self._generate_config,
+                board_def,
+                interface_def,
+                path,
+                skip_unchanged,
+            )
+
+    def _generate_config(
+        self, board, interface, path: Optional[str], skip_unchanged: bool
+    ):
+        # The configurator discards selections before starting, but also put the tree back afterwards,
+        # so nothing from this request (even a failed one) is visible to the next
+        snapshot = self.kconfig.snapshot()
+        try:
+            if path is not None:
+                result = generate_config(
+                    self.klipper_path,
+                    board,
+                    interface,
+                    path,
+                    self.kconfig,
+                    skip_unchanged,
+                )
+                return {
+                    "path": str(Path(path).absolute()),
+                    "cached": result.cached,
+                    "written": result.written,
+                }
+            with tempfile.TemporaryDirectory() as tmp:
+                config_path = Path(tmp) / "config"
+                result = generate_config(
+                    self.klipper_path, board, interface, config_path, self.kconfig
+                )
+                return {"config": config_path.read_text(), "cached": result.cached}
+        finally:
+            self.kconfig.restore(snapshot)
+
+    async def dispatch(self, request: Any) -> Optional[Dict]:
+        """
+        Handle one decoded JSON-RPC request, returning the response (or None for a notification)
+        """
+        if not isinstance(request, dict):
+            return _error_response(None, INVALID_REQUEST, "Invalid request")
+        try:
+            result = await self._call(request)
+        except RPCError as e:
+            response = _error_response(request.get("id"), e.code, e.message)
+        else:
+            response = {"jsonrpc": "2.0", "id": request.get("id"), "result": result}
+        # Notifications get no response, even when they fail
+        return response if "id" in request else None
+
+    async def _call(self, request: Dict):
+        if not isinstance(request.get("method"), str):
+            raise RPCError(INVALID_REQUEST, "Invalid request")
+        if (method := self._methods.get(request["method"])) is None:
+            raise RPCError(METHOD_NOT_FOUND, f"Method {request['method']} not found")
+        params = request.get("params", {})
+        try:
+            if isinstance(params, dict):
+                call = method(**params)
+            elif isinstance(params, list):
+                call = method(*params)
+            else:
+                raise TypeError("params must be an object or array")
+        except TypeError as e:
+            raise RPCError(INVALID_PARAMS, str(e))
+        try:
+            return await call
+        except Exception as e:
+            logger.debug(f"{request['method']} failed", exc_info=True)
+            raise RPCError(REQUEST_FAILED, str(e))
+
+    async def _handle_connection(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ):
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except ValueError:
+                    # Longer than the stream's limit, where the rest of it ends can't be trusted, so stop reading
+                    await _write_response(
+                        writer,
+                        _error_response(None, INVALID_REQUEST, "Request too long"),
+                    )
+                    break
+                if not line:
+                    break
+                if not line.strip():
+                    continue
+                try:
+                    request = json.loads(line)
+                except ValueError:
+                    response = _error_response(None, PARSE_ERROR, "Parse error")
+                else:
+                    response = await self.dispatch(request)
+                if response is not None:
+                    await _write_response(writer, response)
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, socket_path: PathLike):
+        socket_path = Path(socket_path)
+        _claim_socket(socket_path)
+        server = await asyncio.start_unix_server(
+            self._handle_connection, path=str(socket_path)
+        )
+        # Requests can write files as whoever runs the daemon
+        os.chmod(socket_path, 0o600)
+        logger.info(f"Serving on {socket_path}")
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signum, stop.set)
+        try:
+            async with server:
+                await stop.wait()
+        finally:
+            socket_path.unlink(missing_ok=True)
+        logger.info("Stopped")
+
+
+def _error_response(request_id, code: int, message: str) -> Dict:
+    return {
+        "jsonrpc": "2.0",
+        "id": request_id,
+        "error": {"code": code, "message": message},
+    }
+
+
+async def _write_response(writer: asyncio.StreamWriter, response: Dict):
+    writer.write(json.dumps(response).encode("utf-8") + b"\n")
+    await writer.drain()
+
+
+def _claim_socket(socket_path: Path):
+    """
+    Remove a socket left behind by a daemon that is no longer running, refusing to replace a live one
+    """
+    if not socket_path.exists():
+        return
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+        try:
+            probe.connect(str(socket_path))
+        except OSError:
+            socket_path.unlink()
+            return
+    raise RuntimeError(f"A daemon is already listening on {socket_path}")
+
+
+def run(klipper_path: PathLike, socket_path: PathLike):
+    daemon = ConfigDaemon(klipper_path)
+    asyncio.run(daemon.serve(socket_path))
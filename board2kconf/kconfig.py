@@ -1,30 +1,335 @@
+import dataclasses
+import gc
+import hashlib
+import json
+import logging
 import os
+import pickle
+import sys
+import threading
+from contextlib import contextmanager
+from functools import cached_property
 from os import PathLike
 from pathlib import Path
-from typing import List, Optional, Collection
+from typing import List, Optional, Collection, Dict, Tuple, Any, Set, Iterator
 
 from kconfiglib import (
+    VERSION as KCL_VERSION,
     Kconfig as KCLKConfig,
     Choice as KCLChoice,
     Symbol as KCLSymbol,
     BOOL as KCL_BOOL,
+    TRISTATE as KCL_TRISTATE,
 )
 
-from .util import cajole_collection
+from .prompts import PromptIndex
+from .trace import span
+from .util import (
+    atomic_write,
+    cajole_collection,
+    get_cache_dir,
+    git_revision,
+    hash_file,
+    write_atomic,
+)
+
+logger = logging.getLogger(__name__)
+
+# Bump this whenever the layout of the cached tree changes
+_CACHE_FORMAT = 1
+# The menu tree is a deeply linked structure, pickle recurses through it
+_CACHE_RECURSION_LIMIT = 100000
+
+# Trees can be parsed or loaded in background threads (see preload.py), while other threads carry on. The environment,
+# recursion limit and garbage collector are shared by all of them, so changes to them are coordinated here.
+_srctree_lock = threading.Lock()
+_pickling_lock = threading.Lock()
+_pickling_count = 0
+# (recursion limit, whether the collector was enabled) before the first thread started pickling
+_pickling_restore: Tuple[int, bool] = (0, False)
+
+
+@contextmanager
+def _pickling() -> Iterator[None]:
+    """
+    Raise the recursion limit, and pause the garbage collector (unpickling creates a lot of objects, and it only slows
+    that down), for as long as any thread is pickling or unpickling a tree. Both are restored by the last one to finish.
+    """
+    global _pickling_count, _pickling_restore
+    with _pickling_lock:
+        if not _pickling_count:
+            _pickling_restore = (sys.getrecursionlimit(), gc.isenabled())
+            sys.setrecursionlimit(max(_pickling_restore[0], _CACHE_RECURSION_LIMIT))
+            gc.disable()
+        _pickling_count += 1
+    try:
+        yield
+    finally:
+        with _pickling_lock:
+            _pickling_count -= 1
+            if not _pickling_count:
+                old_limit, gc_was_enabled = _pickling_restore
+                sys.setrecursionlimit(old_limit)
+                if gc_was_enabled:
+                    gc.enable()
+
+
+def _fingerprint(srctree: Path, filenames: Collection[str]) -> str:
+    """
+    Fingerprint a klipper checkout by its git HEAD, and the contents of the given kconfig files
+    """
+    manifest = {
+        "head": git_revision(srctree),
+        "files": {name: hash_file(srctree / name) for name in sorted(filenames)},
+    }
+    return hashlib.sha256(
+        json.dumps(manifest, sort_keys=True).encode("utf-8")
+    ).hexdigest()
+
+
+def _cache_paths(srctree: Path):
+    if not (cache_dir := get_cache_dir("kconfig")):
+        return None, None
+    key = hashlib.sha256(str(srctree.absolute()).encode("utf-8")).hexdigest()[:16]
+    return cache_dir / f"{key}.json", cache_dir / f"{key}.pickle"
+
+
+def _read_manifest(srctree: Path) -> Optional[Dict]:
+    manifest_path, _ = _cache_paths(srctree)
+    if not manifest_path:
+        return None
+    try:
+        manifest = json.loads(manifest_path.read_text())
+    except (OSError, ValueError):
+        return None
+    if manifest.get("format") != _CACHE_FORMAT:
+        return None
+    if manifest.get("kconfiglib") != list(KCL_VERSION):
+        return None
+    return manifest
+
+
+def cached_kconfig_fingerprint(srctree: PathLike) -> Optional[str]:
+    """
+    Return the fingerprint of the kconfig tree in the given klipper checkout without parsing it,
+    or None if there is no cached parse to take it from.
+    """
+    srctree = Path(srctree)
+    if manifest := _read_manifest(srctree):
+        return _fingerprint(srctree, manifest["files"])
+    return None
+
+
+def kconfig_fingerprint(srctree: PathLike) -> str:
+    """
+    Return the fingerprint of the kconfig tree in the given klipper checkout.
+    Avoids parsing the tree if a cached parse exists.
+    """
+    if (fingerprint := cached_kconfig_fingerprint(srctree)) is not None:
+        return fingerprint
+    return KConfig(srctree).fingerprint
+
+
+@dataclasses.dataclass(frozen=True)
+class KConfigSnapshot(object):
+    """
+    User values of every symbol and choice in a tree, in unique_defined_syms/unique_choices order
+    """
+
+    symbols: Tuple[Tuple[Any, bool], ...]
+    choices: Tuple[Tuple[Any, Any, bool], ...]
+    assignments: Tuple[Tuple[str, Any], ...]
 
 
 class KConfig(object):
-    def __init__(self, srctree: PathLike):
+    def __init__(self, srctree: PathLike, use_cache: bool = True):
         self.srctree = Path(srctree)
-        self.kcl = self._get_kcl()
+        self.fingerprint = None
+        self.kcl = self._get_kcl(use_cache)
+        # (symbol name, value) of every assignment made through this wrapper, in order
+        self.assignments: List[Tuple[str, Any]] = []
+        self._initial_state = self.snapshot()
+        # Prompts never change once parsed, so each choice's index is built at most once
+        self._prompt_indexes: Dict[KCLChoice, PromptIndex] = {}
+
+    def snapshot(self) -> KConfigSnapshot:
+        """
+        Capture all user selections, so they can be put back later with restore()
+        """
+        return KConfigSnapshot(
+            symbols=tuple(
+                (x.user_value, getattr(x, "_was_set", False))
+                for x in self.kcl.unique_defined_syms
+            ),
+            choices=tuple(
+                (x.user_value, x.user_selection, getattr(x, "_was_set", False))
+                for x in self.kcl.unique_choices
+            ),
+            assignments=tuple(self.assignments),
+        )
+
+    def restore(self, snapshot: KConfigSnapshot):
+        """
+        Put back the user selections captured by snapshot().
+        This is far cheaper than re-parsing, as values are only re-evaluated on demand
+        """
+        for sym, (user_value, was_set) in zip(
+            self.kcl.unique_defined_syms, snapshot.symbols
+        ):
+            sym.user_value = user_value
+            sym._was_set = was_set
+        for choice, (user_value, user_selection, was_set) in zip(
+            self.kcl.unique_choices, snapshot.choices
+        ):
+            choice.user_value = user_value
+            choice.user_selection = user_selection
+            choice._was_set = was_set
+        self.assignments = list(snapshot.assignments)
+        self.kcl._invalidate_all()
+
+    def reset(self):
+        """
+        Discard all selections made since the tree was parsed
+        """
+        self.restore(self._initial_state)
+
+    @span()
+    def _get_kcl(self, use_cache: bool = True):
+        if use_cache and (kc := self._load_cached_kcl()):
+            return kc
+        kc = self._parse_kcl()
+        self.fingerprint = _fingerprint(self.srctree, kc.kconfig_filenames)
+        if use_cache:
+            self._store_cached_kcl(kc)
+        return kc
+
+    def _parse_kcl(self):
+        # kconfiglib reads $srctree while parsing, only that is changed (and put back) for it
+        with _srctree_lock:
+            old_srctree = os.environ.get("srctree")
+            os.environ["srctree"] = str(self.srctree.absolute())
+            try:
+                return KCLKConfig(filename="src/Kconfig")
+            finally:
+                if old_srctree is None:
+                    del os.environ["srctree"]
+                else:
+                    os.environ["srctree"] = old_srctree
 
-    def _get_kcl(self):
-        old_env = os.environ.copy()
-        os.environ["srctree"] = str(self.srctree.absolute())
-        kc = KCLKConfig(filename="src/Kconfig")
-        os.environ = old_env
+    def _load_cached_kcl(self) -> Optional[KCLKConfig]:
+        if not (manifest := _read_manifest(self.srctree)):
+            return None
+        fingerprint = _fingerprint(self.srctree, manifest["files"])
+        if fingerprint != manifest.get("fingerprint"):
+            logger.debug(f"Cached kconfig for {self.srctree} is stale")
+            return None
+        _, tree_path = _cache_paths(self.srctree)
+        try:
+            with _pickling(), tree_path.open("rb") as f:
+                kc = pickle.load(f)
+        except Exception as e:
+            logger.debug(f"Could not load cached kconfig for {self.srctree}: {e!r}")
+            return None
+        self.fingerprint = fingerprint
         return kc
 
+    def _store_cached_kcl(self, kc: KCLKConfig):
+        manifest_path, tree_path = _cache_paths(self.srctree)
+        if not manifest_path:
+            return
+        # The parser leaves a handle to the last file it read, which can't (and needn't) be kept
+        kc._readline = None
+        try:
+            with _pickling(), atomic_write(tree_path) as tmp_path:
+                with tmp_path.open("wb") as f:
+                    pickle.dump(kc, f, protocol=pickle.HIGHEST_PROTOCOL)
+            # Written last, as it is what makes the tree above count as cached
+            write_atomic(
+                manifest_path,
+                json.dumps(
+                    {
+                        "format": _CACHE_FORMAT,
+                        "kconfiglib": list(KCL_VERSION),
+                        "srctree": str(self.srctree.absolute()),
+                        "fingerprint": self.fingerprint,
+                        "files": list(kc.kconfig_filenames),
+                    }
+                ),
+            )
+        except Exception as e:
+            logger.debug(f"Could not cache kconfig for {self.srctree}: {e!r}")
+
+    def assign(self, sym: KCLSymbol, value):
+        """
+        Set a symbol's value, recording the assignment
+        """
+        sym.set_value(value)
+        self.assignments.append((sym.name, value))
+
+    def replay(self, assignments: Collection[Tuple[str, Any]]) -> bool:
+        """
+        Make the given assignments by symbol name.
+        Returns False (leaving any earlier assignments made) as soon as one does not take effect.
+        """
+        for name, value in assignments:
+            if not (sym := self.kcl.syms.get(name)) or not sym.nodes:
+                return False
+            self.assign(sym, value)
+            if sym.type in (KCL_BOOL, KCL_TRISTATE):
+                if sym.tri_value != value:
+                    return False
+            elif sym.str_value != value:
+                return False
+        return True
+
+    def active_files(self) -> Set[str]:
+        """
+        Return the kconfig files (relative to srctree) that define anything visible or set in the current configuration
+        """
+        files = set()
+        for sym in self.kcl.unique_defined_syms:
+            if sym.visibility or sym.str_value not in ("", "n"):
+                files.update(node.filename for node in sym.nodes)
+        for choice in self.kcl.unique_choices:
+            if choice.visibility:
+                files.update(node.filename for node in choice.nodes)
+        return files
+
+    def _config_lines(self) -> Dict[str, str]:
+        """
+        Return the line write_config would write for each symbol, by symbol name
+        """
+        return {
+            sym.name: line
+            for sym in self.kcl.unique_defined_syms
+            if (line := sym.config_string)
+        }
+
+    @span()
+    def config_changes(self, config_path: PathLike) -> Dict[str, Tuple[str, str]]:
+        """
+        Compare the current selections against those of an existing .config, as loaded into this tree.
+        Comments, ordering, and settings this tree would resolve the same way anyway do not count as changes.
+        :return: symbol name -> (line in config_path, line that would be written now) for every symbol that differs,
+                 empty if writing the current selections would change nothing
+        """
+        current = self._config_lines()
+        state = self.snapshot()
+        # Symbols from older klipper versions are expected, and irrelevant here
+        warn = self.kcl.warn
+        self.kcl.warn = False
+        try:
+            self.kcl.load_config(str(Path(config_path).absolute()))
+            existing = self._config_lines()
+        finally:
+            self.kcl.warn = warn
+            self.restore(state)
+        return {
+            name: (existing.get(name, ""), current.get(name, ""))
+            for name in existing.keys() | current.keys()
+            if existing.get(name) != current.get(name)
+        }
+
     @property
     def choices(self):
         return [KConfigChoice(self, x) for x in self._choices()]
@@ -45,15 +350,21 @@ class KConfig(object):
             x for x in self.kcl.unique_choices if (allow_invisible or x.visibility != 0)
         ]
 
+    @cached_property
+    def _index(self) -> "_KConfigIndex":
+        # The tree's structure never changes after parsing, only visibility does, so that is checked on lookup
+        return _KConfigIndex(self.kcl)
+
+    @span()
     def choice(
         self, name: str = None, prompt: str = None, allow_invisible: bool = False
     ) -> Optional["KConfigChoice"]:
         name = cajole_collection(name)
         prompt = cajole_collection(prompt)
         if name:
-            if matches := [
-                x for x in self._choices(allow_invisible) if x.prompt in name
-            ]:
+            if matches := self._index.lookup(
+                self._index.choice_names, name, allow_invisible
+            ):
                 if len(matches) > 1:
                     raise ValueError(
                         f"More than one choice definition defined for {name}"
@@ -63,35 +374,34 @@ class KConfig(object):
             else:
                 raise KeyError(f"Did not find a choice with name {name}")
         elif prompt:
-            for choice in self._choices(allow_invisible):
-                for node in choice.nodes:
-                    if node.prompt[0] in prompt:
-                        return KConfigChoice(self, choice)
-            else:
-                for choice in self._choices(allow_invisible):
-                    for node in choice.nodes:
-                        print(node.prompt[0])
-                raise KeyError(f"Did not find a choice with prompt(label) {prompt}")
+            if matches := self._index.lookup(
+                self._index.choice_prompts, prompt, allow_invisible
+            ):
+                return KConfigChoice(self, matches[0])
+            raise KeyError(f"Did not find a choice with prompt(label) {prompt}")
         else:
             raise ValueError(
                 f"No search for choice specified. This is a bug and should not happen"
             )
         return None
 
+    @span()
     def symbol(
         self, name: str = None, prompt: str = None, allow_invisible: bool = False
     ) -> Optional["KConfigSymbol"]:
         if name:
-            if matches := [x for x in self._symbols(allow_invisible) if x.name == name]:
+            if matches := self._index.lookup(
+                self._index.symbol_names, name, allow_invisible
+            ):
                 if len(matches) > 1:
                     raise ValueError(f"More than one symbol defined for {name}")
                 else:
                     return KConfigSymbol(self, matches[0])
         elif prompt:
-            for symbol in self._symbols(allow_invisible):
-                for node in symbol.nodes:
-                    if node.prompt[0] == prompt:
-                        return KConfigSymbol(self, symbol)
+            if matches := self._index.lookup(
+                self._index.symbol_prompts, prompt, allow_invisible
+            ):
+                return KConfigSymbol(self, matches[0])
         else:
             raise ValueError(
                 f"No search for symbol specified. This is a bug and should not happen"
@@ -99,6 +409,52 @@ class KConfig(object):
         return None
 
 
+class _KConfigIndex(object):
+    """
+    Name and prompt lookup tables for the symbols (excluding choice options) and choices of a tree.
+    Each entry is a list of (definition order, item), regardless of visibility.
+    """
+
+    def __init__(self, kcl: KCLKConfig):
+        self.symbol_names = {}
+        self.symbol_prompts = {}
+        self.choice_names = {}
+        self.choice_prompts = {}
+        for order, sym in enumerate(kcl.unique_defined_syms):
+            if sym.choice:
+                continue
+            self._add(self.symbol_names, sym.name, order, sym)
+            for node in sym.nodes:
+                if node.prompt:
+                    self._add(self.symbol_prompts, node.prompt[0], order, sym)
+        for order, choice in enumerate(kcl.unique_choices):
+            if choice.name:
+                self._add(self.choice_names, choice.name, order, choice)
+            for node in choice.nodes:
+                if node.prompt:
+                    self._add(self.choice_prompts, node.prompt[0], order, choice)
+
+    @staticmethod
+    def _add(table: Dict, key: str, order: int, item):
+        entries = table.setdefault(key, [])
+        if (order, item) not in entries:
+            entries.append((order, item))
+
+    @staticmethod
+    def lookup(table: Dict, keys: str | Collection[str], allow_invisible: bool):
+        """
+        Return the items matching any of keys, in definition order
+        """
+        if isinstance(keys, str):
+            entries = table.get(keys, [])
+        else:
+            entries = sorted(
+                {entry for key in keys for entry in table.get(key, ())},
+                key=lambda entry: entry[0],
+            )
+        return [item for _, item in entries if allow_invisible or item.visibility != 0]
+
+
 class KConfigChoice(object):
     def __init__(self, kc: KConfig, choice: KCLChoice):
         self._kc = kc
@@ -129,6 +485,26 @@ class KConfigChoice(object):
     def choices(self) -> List[KCLSymbol]:
         return self._choice.syms
 
+    def prompt_index(self) -> PromptIndex:
+        """
+        Structured lookups over this choice's options, see :class:`PromptIndex`
+        """
+        indexes = self._kc._prompt_indexes
+        if (index := indexes.get(self._choice)) is None:
+            index = indexes[self._choice] = PromptIndex(
+                (x, self._get_prompt(x)) for x in self._choice.syms
+            )
+        return index
+
+    def select_option(self, option: Optional[KCLSymbol]) -> bool:
+        """
+        Select an option found through :meth:`prompt_index`, returns False if there was none
+        """
+        if option is None:
+            return False
+        self._kc.assign(option, 2)
+        return True
+
     def select(self, name: str = None, prompt: str = None):
         name = cajole_collection(name)
         prompt = cajole_collection(prompt)
@@ -136,7 +512,7 @@ class KConfigChoice(object):
         if name is not None:
             matches = [x for x in self._choice.syms if x.name in name]
             if len(matches):
-                matches[0].set_value(2)
+                self._kc.assign(matches[0], 2)
             else:
                 raise ValueError(
                     f"No option {name} found for {self.prompt} ({self.values!r})"
@@ -145,7 +521,7 @@ class KConfigChoice(object):
             for choice in self._choice.syms:
                 for node in choice.nodes:
                     if node.prompt[0] in prompt:
-                        choice.set_value(2)
+                        self._kc.assign(choice, 2)
                         return
             raise ValueError(
                 f"No option {prompt} found for {self.prompt} ({self.prompts()!r}"
@@ -166,14 +542,14 @@ class KConfigSymbol(object):
         if self._symbol.type == KCL_BOOL:
             if type(val) is bool:
                 if val:
-                    self._symbol.set_value(2)
+                    self._kc.assign(self._symbol, 2)
                 else:
-                    self._symbol.set_value(0)
+                    self._kc.assign(self._symbol, 0)
                 # Klipper doesn't use "m"
             else:
                 raise ValueError(f"Not a boolean {val}")
         else:
-            self._symbol.set_value(val)
+            self._kc.assign(self._symbol, val)
 
     def get(self):
         if self._symbol.type == KCL_BOOL:
@@ -1,39 +1,406 @@
 import dataclasses
+import hashlib
 import json
 import logging
 from functools import cached_property, cache
 from os import PathLike
 from pathlib import Path
-from typing import Union, Optional, Dict, TextIO
-
-from .util import get_boards
+from typing import (
+    Any,
+    Callable,
+    Collection,
+    Union,
+    Optional,
+    Dict,
+    List,
+    Set,
+    TextIO,
+    Tuple,
+)
+
+from .boardindex import dump_index, load_index
+from .schema import format_path, validate_boards
+from .search import SearchIndex
+from .util import get_boards, get_board_index, get_cache_dir, hash_file
 
 logger = logging.getLogger(__name__)
 
 
+def _content_hash(definition) -> str:
+    return hashlib.sha256(
+        json.dumps(dataclasses.asdict(definition), sort_keys=True).encode("utf-8")
+    ).hexdigest()
+
+
+# The modules deciding what the derived indexes of a database hold
+_DERIVED_MODULES = ("model.py", "search.py")
+
+
+@cache
+def _derived_code() -> Tuple[Optional[str], ...]:
+    package = Path(__file__).parent
+    return tuple(hash_file(package / name) for name in _DERIVED_MODULES)
+
+
+def _items(data):
+    return data.items() if isinstance(data, dict) else ()
+
+
 class BoardDatabase(object):
-    def __init__(self, source: TextIO | PathLike | None = None):
+    def __init__(self, source: TextIO | PathLike | None = None, lazy: bool = False):
+        """
+        :param source: The board database, by default the precompiled index (if current) or JSON from get_boards()
+        :param lazy: Only build definitions for boards as they are looked up, instead of all of them up front
+        """
+        # (category, manufacturer, model, variant, raw definition), in file order
+        self._entries = []
+        # manufacturer -> model -> variant -> position in _entries
+        self._index: Dict[str, Dict[str, Dict[str, int]]] = {}
+        self._duplicates = set()
+        # position in _entries -> definition, or None if it could not be built
+        self._boards: Dict[int, Optional[BoardDefinition]] = {}
+        # Name -> state of the indexes derived from the entries, as read from the precompiled index
+        self._derived: Dict[str, Any] = {}
+        # Identifies the JSON the entries were loaded from (and what was left out of it), to cache derived indexes
+        self._source_key: Optional[str] = None
         if source is None:
-            self._boards = list(BoardDefinition.read_from_stream(get_boards()))
-        elif isinstance(source, PathLike):
-            self._boards = list(BoardDefinition.read_from_file(source))
-        elif isinstance(source, TextIO):
-            self._boards = list(BoardDefinition.read_from_stream(source))
+            if not ((index_path := get_board_index()) and self._load_index(index_path)):
+                with get_boards() as stream:
+                    self._load_json(stream.read())
+        elif isinstance(source, (str, PathLike)):
+            self._load_json(Path(source).read_bytes())
+        else:
+            self._load_json(source.read())
+        if not lazy:
+            self.get_all()
+
+    def _load_json(self, content: str | bytes):
+        if isinstance(content, str):
+            content = content.encode("utf-8")
+        json_data = json.loads(content)
+        entries = BoardDefinition.iter_data(json_data)
+        if problems := validate_boards(json_data, content):
+            for path, messages in problems.items():
+                for message in messages:
+                    logger.warning(
+                        f"Invalid board definition {format_path(path)}: {message}"
+                    )
+            # Leave out every board with a problem, including boards beneath a broken manufacturer or model
+            entries = (
+                entry
+                for entry in entries
+                if not any(entry[: len(path)] == path for path in problems)
+            )
+        self._entries = list(entries)
+        self._index, self._duplicates = self._build_index(self._entries)
+        self._source_key = hashlib.sha256(
+            hashlib.sha256(content).digest()
+            + json.dumps(sorted(problems)).encode("utf-8")
+        ).hexdigest()
+
+    def _load_index(self, path: PathLike) -> bool:
+        if not (payload := load_index(path)):
+            return False
+        self._entries = payload["entries"]
+        self._index = payload["index"]
+        self._duplicates = payload["duplicates"]
+        self._derived = {"hardware": payload["hardware"], "search": payload["search"]}
+        return True
+
+    def write_index(self, path: PathLike) -> int:
+        """
+        Write the usable boards in this database to a precompiled index, returning how many there were
+        """
+        usable = [
+            (entry, board)
+            for position, entry in enumerate(self._entries)
+            if (board := self._materialise(position)) is not None
+        ]
+        entries = tuple(entry for entry, _ in usable)
+        index, duplicates = self._build_index(entries)
+        hardware = _HardwareIndex()
+        for position, (_, board) in enumerate(usable):
+            hardware.add(position, board)
+        dump_index(
+            path,
+            {
+                "entries": entries,
+                "index": index,
+                "duplicates": duplicates,
+                "hardware": hardware.state(),
+                "search": SearchIndex(self._search_documents(entries, index)).state(),
+            },
+        )
+        return len(entries)
+
+    @classmethod
+    @cache
+    def default(cls) -> "BoardDatabase":
+        """
+        The database from the default location, loaded once
+        """
+        return cls(lazy=True)
+
+    @staticmethod
+    def _build_index(entries):
+        index = {}
+        duplicates = set()
+        for position, (_, manufacturer, model, variant, _) in enumerate(entries):
+            variants = index.setdefault(manufacturer, {}).setdefault(model, {})
+            if variant in variants:
+                logger.warning(
+                    f"Duplicate board definition for {manufacturer}/{model}/{variant}"
+                )
+                duplicates.add((manufacturer, model, variant))
+            else:
+                variants[variant] = position
+        return index, duplicates
+
+    def _materialise(self, position: int) -> Optional["BoardDefinition"]:
+        if position not in self._boards:
+            entry = self._entries[position]
+            board = self._boards[position] = BoardDefinition.from_entry(*entry)
+            if board is None:
+                self._forget(*entry[1:4])
+        return self._boards[position]
+
+    def _forget(self, manufacturer, model, variant):
+        # Keep the listings to boards that can actually be used
+        models = self._index.get(manufacturer, {})
+        variants = models.get(model, {})
+        variants.pop(variant, None)
+        if not variants:
+            models.pop(model, None)
+        if not models:
+            self._index.pop(manufacturer, None)
 
     def get(self, manufacturer, model, variant):
-        if mfr_matches := [x for x in self._boards if x.manufacturer == manufacturer]:
-            if model_matches := [x for x in mfr_matches if x.model == model]:
-                if variant_matches := [
-                    x for x in model_matches if x.variant == variant
-                ]:
-                    if len(variant_matches) > 1:
-                        raise ValueError("Duplicate board definition")
-                    elif len(variant_matches) == 1:
-                        return variant_matches[0]
+        if (manufacturer, model, variant) in self._duplicates:
+            raise ValueError("Duplicate board definition")
+        try:
+            position = self._index[manufacturer][model][variant]
+        except KeyError:
+            position = None
+        if position is not None and (board := self._materialise(position)):
+            return board
         raise ValueError(f"No board data for {manufacturer}/{model}/{variant}")
 
+    def find(self, name: str) -> "BoardDefinition":
+        """
+        Look up a board by its manufacturer/model/variant name, as printed for a BoardDefinition.
+        Names themselves may contain "/", so every way of splitting it into three is tried.
+        """
+        parts = name.split("/")
+        for i in range(1, len(parts) - 1):
+            for j in range(i + 1, len(parts)):
+                manufacturer = "/".join(parts[:i])
+                model = "/".join(parts[i:j])
+                variant = "/".join(parts[j:])
+                if variant in self._index.get(manufacturer, {}).get(model, {}):
+                    return self.get(manufacturer, model, variant)
+        raise ValueError(f"No board data for {name}")
+
+    @staticmethod
+    def _search_documents(entries, index):
+        # From the raw entries, so boards only need materialising once they turn up in results
+        documents = []
+        for manufacturer, models in index.items():
+            for model, variants in models.items():
+                for variant, position in variants.items():
+                    mcu = entries[position][4].get("mcu")
+                    documents.append(
+                        (
+                            (manufacturer, model, variant),
+                            (
+                                manufacturer,
+                                model,
+                                variant,
+                                mcu.get("mcu") if isinstance(mcu, dict) else None,
+                            ),
+                        )
+                    )
+        return documents
+
+    @cached_property
+    def _search_index(self) -> SearchIndex:
+        return SearchIndex.from_state(
+            self._derived_index(
+                "search",
+                lambda: SearchIndex(
+                    self._search_documents(self._entries, self._index)
+                ).state(),
+            )
+        )
+
+    def search(self, text: str, limit: int = 20) -> List["BoardDefinition"]:
+        """
+        Return the boards best matching text by manufacturer, model, variant or MCU, best first.
+        Matching is forgiving of partial words and typos, see SearchIndex.
+        """
+        boards = []
+        for _, (manufacturer, model, variant) in self._search_index.search(text, limit):
+            try:
+                boards.append(self.get(manufacturer, model, variant))
+            except ValueError:
+                # Unusable (or duplicated) definition
+                continue
+        return boards
+
+    def _derived_index(self, name: str, build: Callable[[], Any]) -> Any:
+        """
+        Return the state of an index derived from the entries: from the precompiled index, or cached against the
+        JSON the entries were loaded from. Only if neither has it is it built (and cached).
+        """
+        if name in self._derived:
+            return self._derived[name]
+        cache_dir = get_cache_dir("boards") if self._source_key else None
+        cached_path = None
+        if cache_dir:
+            key = hashlib.sha256(
+                json.dumps([name, self._source_key, *_derived_code()]).encode("utf-8")
+            ).hexdigest()
+            cached_path = cache_dir / f"{key}.idx"
+            if (state := load_index(cached_path, keys=None)) is not None:
+                return state
+        state = build()
+        if cached_path:
+            try:
+                dump_index(cached_path, state)
+            except OSError:
+                pass
+        return state
+
+    def _build_hardware_index(self):
+        index = _HardwareIndex()
+        for position in range(len(self._entries)):
+            if (board := self._materialise(position)) is not None:
+                index.add(position, board)
+        return index.state()
+
+    @cached_property
+    def _hardware_index(self) -> "_HardwareIndex":
+        # Building it takes every board, so it is loaded instead wherever possible
+        return _HardwareIndex.from_state(
+            self._derived_index("hardware", self._build_hardware_index)
+        )
+
+    def query(
+        self,
+        arch: Optional[str] = None,
+        mcu: Optional[str] = None,
+        clock: Optional[str] = None,
+        flash: Optional[str] = None,
+        interface: Optional[str] = None,
+        pins: Collection[str] = (),
+    ) -> List["BoardDefinition"]:
+        """
+        Return the boards matching every given criterion (case-insensitively), in database order
+        :param interface: Only boards with this interface type (e.g. "can")
+        :param pins: Only boards using all of these pins for an interface (of the given type, if there is one)
+        """
+        index = self._hardware_index
+        criteria = [
+            index.arch.get(arch.lower(), set()) if arch else None,
+            index.mcu.get(mcu.lower(), set()) if mcu else None,
+            index.clock.get(clock.lower(), set()) if clock else None,
+            index.flash.get(flash.lower(), set()) if flash else None,
+            index.interface.get(interface.upper(), set()) if interface else None,
+        ]
+        if_type = interface.upper() if interface else None
+        criteria.extend(index.pins.get((if_type, pin.upper()), set()) for pin in pins)
+        selected = [x for x in criteria if x is not None]
+        if selected:
+            # Smallest first, so each intersection is as cheap as possible
+            selected.sort(key=len)
+            positions = set(selected[0]).intersection(*selected[1:])
+        else:
+            positions = index.all
+        # Only the boards found are built
+        return [
+            board
+            for position in sorted(positions)
+            if (board := self._materialise(position)) is not None
+        ]
+
     def get_all(self):
-        return self._boards.copy()
+        return [
+            board
+            for position in range(len(self._entries))
+            if (board := self._materialise(position)) is not None
+        ]
+
+    def manufacturers(self) -> Tuple[str, ...]:
+        return tuple(sorted(self._index))
+
+    def models(self, manufacturer: str) -> Tuple[str, ...]:
+        return tuple(sorted(self._index.get(manufacturer, {})))
+
+    def variants(self, manufacturer: str, model: str) -> Tuple[str, ...]:
+        # A model only has a few variants, build them now so ones that cannot be used are left out
+        for position in list(self._index.get(manufacturer, {}).get(model, {}).values()):
+            self._materialise(position)
+        return tuple(sorted(self._index.get(manufacturer, {}).get(model, {})))
+
+
+class _HardwareIndex(object):
+    """
+    Positions of boards in a BoardDatabase, by their hardware (lower-cased, except interface types)
+    """
+
+    def __init__(self):
+        self.all: Set[int] = set()
+        self.arch: Dict[str, Set[int]] = {}
+        self.mcu: Dict[str, Set[int]] = {}
+        self.clock: Dict[str, Set[int]] = {}
+        self.flash: Dict[str, Set[int]] = {}
+        self.interface: Dict[str, Set[int]] = {}
+        # (interface type or None for any, upper-cased pin) -> positions
+        self.pins: Dict[Tuple[Optional[str], str], Set[int]] = {}
+
+    @staticmethod
+    def _add(table: Dict, key: Optional[str], position: int):
+        if key:
+            table.setdefault(key, set()).add(position)
+
+    def state(self) -> Tuple:
+        """
+        The index as plain data, for marshal (see from_state)
+        """
+        return (
+            self.all,
+            self.arch,
+            self.mcu,
+            self.clock,
+            self.flash,
+            self.interface,
+            self.pins,
+        )
+
+    @classmethod
+    def from_state(cls, state: Tuple) -> "_HardwareIndex":
+        index = cls()
+        (
+            index.all,
+            index.arch,
+            index.mcu,
+            index.clock,
+            index.flash,
+            index.interface,
+            index.pins,
+        ) = state
+        return index
+
+    def add(self, position: int, board: "BoardDefinition"):
+        self.all.add(position)
+        self._add(self.arch, board.mcu.arch.lower(), position)
+        self._add(self.mcu, board.mcu.mcu.lower(), position)
+        self._add(self.clock, (board.mcu.clock or "").lower(), position)
+        self._add(self.flash, (board.mcu.flash or "").lower(), position)
+        for interface in board.interfaces:
+            self._add(self.interface, interface.if_type, position)
+            for pin in interface.pins.values():
+                self._add(self.pins, (interface.if_type, pin.upper()), position)
+                self._add(self.pins, (None, pin.upper()), position)
 
 
 @dataclasses.dataclass
@@ -51,6 +418,12 @@ class BoardDefinition(object):
     def __str__(self):
         return f"{self.manufacturer}/{self.model}/{self.variant}"
 
+    def content_hash(self) -> str:
+        """
+        Return a hash of everything this definition says about the board
+        """
+        return _content_hash(self)
+
     @classmethod
     def get_one_from_file(
         cls, file: PathLike, category: str, manufacturer: str, model: str, variant: str
@@ -70,24 +443,40 @@ class BoardDefinition(object):
 
     @classmethod
     def read_from_file(cls, file: PathLike):
-        yield cls.read_from_stream(Path(file).open())
+        yield from cls.read_from_stream(Path(file).open())
 
     @classmethod
     def read_from_stream(cls, stream: TextIO):
-        json_data = json.load(stream)
-        for category, manufacturers in json_data.items():
-            for manufacturer, products in manufacturers.items():
-                for product, variants in products.items():
-                    for variant, json_defn in variants.items():
-                        try:
-                            yield BoardDefinition.from_data(
-                                manufacturer, product, variant, json_defn
-                            )
-                        except KeyError as e:
-                            logger.warning(
-                                f"Board definition for {category}/{manufacturer}/{product}/{variant} is missing {e.args[0]}, skipping..."
-                            )
-                            continue
+        for entry in cls.iter_data(json.load(stream)):
+            if (board := cls.from_entry(*entry)) is not None:
+                yield board
+
+    @staticmethod
+    def iter_data(json_data: Dict):
+        """
+        Yield (category, manufacturer, model, variant, raw definition) for every board in a database
+        """
+        # Levels that are not objects are reported by validation, and have no boards to give
+        for category, manufacturers in _items(json_data):
+            for manufacturer, products in _items(manufacturers):
+                for product, variants in _items(products):
+                    for variant, json_defn in _items(variants):
+                        yield category, manufacturer, product, variant, json_defn
+
+    @classmethod
+    def from_entry(
+        cls, category, manufacturer, model, variant, definition: Dict
+    ) -> Optional["BoardDefinition"]:
+        """
+        Like from_data, but logs and returns None for an incomplete definition
+        """
+        try:
+            return cls.from_data(manufacturer, model, variant, definition)
+        except KeyError as e:
+            logger.warning(
+                f"Board definition for {category}/{manufacturer}/{model}/{variant} is missing {e.args[0]}, skipping..."
+            )
+            return None
 
     @classmethod
     def get_all_from_file(cls, file: PathLike):
@@ -98,22 +487,13 @@ class BoardDefinition(object):
     @classmethod
     @cache
     def get_all(cls):
-        boards = list(cls.read_from_stream(get_boards()))
+        boards = BoardDatabase.default().get_all()
         logger.info(f"Loaded {len(boards)} boards")
         return boards
 
     @classmethod
     def get(cls, manufacturer, model, variant):
-        if mfr_matches := [x for x in cls.get_all() if x.manufacturer == manufacturer]:
-            if model_matches := [x for x in mfr_matches if x.model == model]:
-                if variant_matches := [
-                    x for x in model_matches if x.variant == variant
-                ]:
-                    if len(variant_matches) > 1:
-                        raise ValueError("Duplicate board definition")
-                    elif len(variant_matches) == 1:
-                        return variant_matches[0]
-        raise ValueError(f"No board data for {manufacturer}/{model}/{variant}")
+        return BoardDatabase.default().get(manufacturer, model, variant)
 
     @classmethod
     def from_data(
@@ -150,6 +530,32 @@ class BoardDefinition(object):
             interfaces.append(self.can.as_interface())
         return interfaces
 
+    def interface(self, if_type: str) -> "BoardInterfaceDefinition":
+        """
+        Return the board's interface of the given type (e.g. "usb"), case-insensitively
+        """
+        for interface in self.interfaces:
+            if interface.if_type == if_type.upper():
+                return interface
+        raise ValueError(f"{self} does not have a {if_type.upper()} interface")
+
+    def as_dict(self) -> Dict:
+        """
+        Describe the board as plain data, suitable for JSON
+        """
+        return {
+            "board": str(self),
+            "manufacturer": self.manufacturer,
+            "model": self.model,
+            "variant": self.variant,
+            "mcu": dataclasses.asdict(self.mcu),
+            "interfaces": [
+                {"type": x.if_type, "pins": x.pins} for x in self.interfaces
+            ],
+            "status": self.status,
+            "klipper_options": self.klipper_options,
+        }
+
     def pretty(self, indent=0):
         retstr = f"{self.manufacturer} {self.model}"
         if self.model != self.variant:
@@ -236,6 +642,9 @@ class BoardInterfaceDefinition(object):
     def __str__(self) -> str:
         return f"{self.if_type.upper()}"
 
+    def content_hash(self) -> str:
+        return _content_hash(self)
+
     @classmethod
     def usb(cls, spec):
         if spec:
@@ -0,0 +1,64 @@
+import logging
+import threading
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from typing import Any, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class Preloader(object):
+    """
+    Runs slow loaders (e.g. the Kconfig parse) in background threads, ahead of when their results are needed.
+
+    Threads are daemons, so quitting never waits on a load nobody asked for.
+    """
+
+    def __init__(self, loaders: Dict[str, Callable[[], Any]]):
+        self._loaders = loaders
+        self._futures: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+
+    def start(self, name: Optional[str] = None):
+        """
+        Start the named loader (or all of them), if not already started
+        """
+        for loader_name in [name] if name else self._loaders:
+            self._future(loader_name)
+
+    def _future(self, name: str) -> Future:
+        with self._lock:
+            if (future := self._futures.get(name)) is not None:
+                return future
+            future = self._futures[name] = Future()
+        loader = self._loaders[name]
+
+        def run():
+            if not future.set_running_or_notify_cancel():
+                return
+            try:
+                future.set_result(loader())
+            except BaseException as e:
+                logger.debug(f"Preloading {name} failed", exc_info=True)
+                future.set_exception(e)
+
+        threading.Thread(target=run, name=f"preload-{name}", daemon=True).start()
+        return future
+
+    def done(self, name: str) -> bool:
+        return self._future(name).done()
+
+    def wait(self, name: str, timeout: Optional[float] = None) -> bool:
+        """
+        Wait up to timeout seconds for a loader to finish, returning whether it has
+        """
+        try:
+            self._future(name).exception(timeout)
+        except FutureTimeoutError:
+            return False
+        return True
+
+    def result(self, name: str):
+        """
+        Return the result of a loader, waiting for it (and starting it if needed). Re-raises if it failed.
+        """
+        return self._future(name).result()
@@ -0,0 +1,85 @@
+import dataclasses
+import re
+from typing import Any, Dict, FrozenSet, Iterable, List, Optional, Tuple
+
+# Clock options are offered as "8 MHz crystal", "12MHz", "32KHz" and so on
+_FREQ_PROMPT_RE = re.compile(r"^([0-9]+) ?([MK]hz)", flags=re.IGNORECASE)
+# "USB (on PA11/PA12)", "CAN bus (on PB8/PB9)"
+_PINNED_PROMPT_RE = re.compile(r"^(USB|CAN bus) \(on ([^/ ]+)/([^/ )]+)\)")
+# "Serial (on USART1 PA10/PA9)", "UART0 on GPIO1/GPIO0", "Serial (on UART0 P0.3/P0.2)"
+_UART_PROMPT_RE = re.compile(
+    r"^(Serial \(?on )?US?ART[0-9]* (on )?([^/ ]+)/([^/ )]+)\)?"
+)
+
+
+@dataclasses.dataclass(frozen=True)
+class PromptFacts(object):
+    """
+    Everything the configurator matches on, as parsed from one choice option's prompt
+    """
+
+    mcu: str
+    flash: str
+    freq: Optional[Tuple[str, str]] = None
+    usb_pins: Optional[Tuple[str, str]] = None
+    can_pins: Optional[Tuple[str, str]] = None
+    uart_pins: Optional[FrozenSet[str]] = None
+
+    @classmethod
+    def parse(cls, prompt: str) -> "PromptFacts":
+        word = prompt.split(" ")[0]
+        facts = {"mcu": word, "flash": word.lower()}
+        if matches := _FREQ_PROMPT_RE.match(prompt):
+            facts["freq"] = freq_key(*matches.groups())
+        if matches := _PINNED_PROMPT_RE.match(prompt):
+            kind, first, second = matches.groups()
+            facts["usb_pins" if kind == "USB" else "can_pins"] = (first, second)
+        if matches := _UART_PROMPT_RE.match(prompt):
+            facts["uart_pins"] = frozenset(matches.groups()[2:])
+        return cls(**facts)
+
+
+def freq_key(rate: str, units: str) -> Tuple[str, str]:
+    return rate, units.lower()
+
+
+class PromptIndex(object):
+    """
+    Lookup tables over the options of a single choice, built once from their prompts.
+
+    Where several options share a key the first in definition order wins, except for mcus,
+    where every option is kept (the configurator selects all of them).
+    """
+
+    def __init__(self, options: Iterable[Tuple[Any, str]]):
+        self._options: List[Tuple[Any, str]] = list(options)
+        self.mcus: Dict[str, List[Any]] = {}
+        self.freqs: Dict[Tuple[str, str], Any] = {}
+        self.flash_chips: Dict[str, Any] = {}
+        self.usb: Dict[Tuple[str, str], Any] = {}
+        self.can: Dict[Tuple[str, str], Any] = {}
+        self.uart: Dict[FrozenSet[str], Any] = {}
+        for option, prompt in self._options:
+            facts = PromptFacts.parse(prompt)
+            self.mcus.setdefault(facts.mcu, []).append(option)
+            self.flash_chips.setdefault(facts.flash, option)
+            if facts.freq:
+                self.freqs.setdefault(facts.freq, option)
+            if facts.usb_pins:
+                self.usb.setdefault(facts.usb_pins, option)
+            if facts.can_pins:
+                self.can.setdefault(facts.can_pins, option)
+            if facts.uart_pins:
+                self.uart.setdefault(facts.uart_pins, option)
+
+    def flash(self, chip: str):
+        """
+        Find the option for a flash chip, falling back to a prefix match on the prompt
+        """
+        chip = chip.lower()
+        if (option := self.flash_chips.get(chip)) is not None:
+            return option
+        for option, prompt in self._options:
+            if prompt.lower().startswith(chip):
+                return option
+        return None
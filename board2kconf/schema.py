@@ -0,0 +1,216 @@
+"""
+Validation of the board database against its JSON schema.
+
+Only the parts of JSON schema the board schema uses are supported (type, properties, required,
+additionalProperties, oneOf, items and minProperties), which is enough to avoid a dependency. The schema is
+compiled into nested closures once, so validating an entry does no schema interpretation at all.
+"""
+
+import hashlib
+import json
+import logging
+from functools import cache
+from importlib.resources import files
+from typing import Any, Callable, Dict, List, Tuple
+
+from .util import get_cache_dir, write_atomic
+
+logger = logging.getLogger(__name__)
+
+# Bump whenever the validator's behaviour changes, so cached verdicts are not reused
+_VALIDATOR_VERSION = 1
+
+Path_ = Tuple[str, ...]
+Validator = Callable[[Any, Path_, List[Tuple[Path_, str]]], None]
+
+_TYPES = {
+    "object": dict,
+    "array": list,
+    "string": str,
+    "null": type(None),
+}
+_KEYWORDS = {
+    "type",
+    "properties",
+    "required",
+    "additionalProperties",
+    "oneOf",
+    "items",
+    "minProperties",
+}
+# Annotations only, they never affect validity
+_IGNORED_KEYWORDS = {"title", "description", "$schema", "$id"}
+
+
+def compile_schema(schema: Dict) -> Validator:
+    """
+    Compile a schema into a function of (value, path, errors) that appends (path, message) for every problem
+    with value to errors.
+    """
+    if unknown := set(schema) - _KEYWORDS - _IGNORED_KEYWORDS:
+        raise ValueError(f"Unsupported schema keywords {sorted(unknown)}")
+    checks: List[Validator] = []
+
+    if (type_name := schema.get("type")) is not None:
+        if (expected := _TYPES.get(type_name)) is None:
+            raise ValueError(f"Unsupported schema type {type_name}")
+
+        def check_type(value, path, errors):
+            if not isinstance(value, expected):
+                errors.append((path, f"expected {type_name}, got {_describe(value)}"))
+
+        checks.append(check_type)
+
+    if "oneOf" in schema:
+        options = [compile_schema(x) for x in schema["oneOf"]]
+
+        def check_one_of(value, path, errors):
+            matched = 0
+            for option in options:
+                option_errors = []
+                option(value, path, option_errors)
+                if not option_errors:
+                    matched += 1
+            if matched != 1:
+                errors.append(
+                    (
+                        path,
+                        f"{_describe(value)} matches {matched} of {len(options)} allowed forms, not 1",
+                    )
+                )
+
+        checks.append(check_one_of)
+
+    object_checks: List[Validator] = []
+    properties = {
+        name: compile_schema(x) for name, x in schema.get("properties", {}).items()
+    }
+    required = tuple(schema.get("required", ()))
+    additional = schema.get("additionalProperties", True)
+    if isinstance(additional, dict):
+        additional = compile_schema(additional)
+    if properties or additional is not True:
+
+        def check_properties(value, path, errors):
+            for name, item in value.items():
+                if (validator := properties.get(name)) is not None:
+                    validator(item, path + (name,), errors)
+                elif additional is False:
+                    errors.append((path, f"unexpected property {name!r}"))
+                elif additional is not True:
+                    additional(item, path + (name,), errors)
+
+        object_checks.append(check_properties)
+    if required:
+
+        def check_required(value, path, errors):
+            for name in required:
+                if name not in value:
+                    errors.append((path, f"missing required property {name!r}"))
+
+        object_checks.append(check_required)
+    if (min_properties := schema.get("minProperties")) is not None:
+
+        def check_min_properties(value, path, errors):
+            if len(value) < min_properties:
+                errors.append(
+                    (
+                        path,
+                        f"needs at least {min_properties} properties, has {len(value)}",
+                    )
+                )
+
+        object_checks.append(check_min_properties)
+
+    if "items" in schema:
+        item_validator = compile_schema(schema["items"])
+
+        def check_items(value, path, errors):
+            if isinstance(value, list):
+                for i, item in enumerate(value):
+                    item_validator(item, path + (str(i),), errors)
+
+        checks.append(check_items)
+
+    if object_checks:
+
+        def check_object(value, path, errors):
+            # Object keywords do not apply to other types
+            if isinstance(value, dict):
+                for check in object_checks:
+                    check(value, path, errors)
+
+        checks.append(check_object)
+
+    if len(checks) == 1:
+        return checks[0]
+
+    def validate(value, path, errors):
+        for check in checks:
+            check(value, path, errors)
+
+    return validate
+
+
+def _describe(value) -> str:
+    for name, python_type in _TYPES.items():
+        if isinstance(value, python_type):
+            return name
+    if isinstance(value, bool):
+        return "boolean"
+    return type(value).__name__
+
+
+def _schema_text() -> str:
+    return files("board2kconf.data").joinpath("v1.schema.json").read_text()
+
+
+@cache
+def _board_validator() -> Validator:
+    return compile_schema(json.loads(_schema_text()))
+
+
+def format_path(path: Path_) -> str:
+    return "/".join(path) if path else "(top level)"
+
+
+def validate_boards(json_data: Any, content: bytes) -> Dict[Path_, List[str]]:
+    """
+    Validate a board database against the schema, reporting every problem at once.
+    The verdict is cached against the hash of the database's content (as read from boards.json, and parsed
+    into json_data), so an unchanged database is only validated once.
+    :return: Problems, by the path of the board (category, manufacturer, model, variant) they were found in
+             (shorter if above any board), empty if the database is valid.
+    """
+    schema_text = _schema_text()
+    key = hashlib.sha256(
+        f"{_VALIDATOR_VERSION}:".encode("utf-8")
+        + hashlib.sha256(schema_text.encode("utf-8")).digest()
+        + hashlib.sha256(content).digest()
+    ).hexdigest()
+    cache_dir = get_cache_dir("schema")
+    cached_path = cache_dir / f"{key}.json" if cache_dir else None
+    if cached_path:
+        try:
+            return {
+                tuple(path): messages
+                for path, messages in json.loads(cached_path.read_text())
+            }
+        except (OSError, ValueError):
+            pass
+
+    errors: List[Tuple[Path_, str]] = []
+    _board_validator()(json_data, (), errors)
+    problems: Dict[Path_, List[str]] = {}
+    for path, message in errors:
+        if len(path) > 4:
+            # Relative to the board
+            message = f"{format_path(path[4:])}: {message}"
+        problems.setdefault(path[:4], []).append(message)
+
+    if cached_path:
+        try:
+            write_atomic(cached_path, json.dumps(list(problems.items())))
+        except OSError:
+            pass
+    return problems
@@ -0,0 +1,130 @@
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable, Dict, Optional
+
+from .. import configurator
+from ..bench.synthetic import board_key, synthetic_boards, write_klipper_tree
+from ..configurator import Configurator
+from ..kconfig import KConfig, KCL_VERSION
+from ..model import BoardDatabase
+from ..util import git_revision
+
+
+def _time(
+    fn: Callable, repeat: int, setup: Optional[Callable] = None
+) -> Dict[str, float]:
+    samples = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return {
+        "runs": repeat,
+        "min_ms": min(samples),
+        "median_ms": statistics.median(samples),
+        "mean_ms": statistics.fmean(samples),
+    }
+
+
+def _cold_plans():
+    # Make the configurator search for every selection, instead of replaying what it found last time
+    configurator._plan_store.cache_clear()
+
+
+def run(workdir: Path, archs: int, mcus: int, comms: int, repeat: int) -> Dict:
+    klipper = write_klipper_tree(workdir / "klipper", archs, mcus, comms)
+    boards_path = workdir / "boards.json"
+    boards_path.write_text(json.dumps(synthetic_boards(archs, mcus, comms)))
+    results = {}
+
+    # Nothing is cached unless a benchmark asks for it
+    os.environ["KBOARD_CACHE_PATH"] = ""
+    results["kconfig_parse"] = _time(lambda: KConfig(klipper), repeat)
+    os.environ["KBOARD_CACHE_PATH"] = str(workdir / "cache")
+    KConfig(klipper)
+    results["kconfig_parse_cached"] = _time(lambda: KConfig(klipper), repeat)
+    os.environ["KBOARD_CACHE_PATH"] = ""
+
+    results["board_db_load"] = _time(lambda: BoardDatabase(boards_path), repeat)
+    results["board_db_load_lazy"] = _time(
+        lambda: BoardDatabase(boards_path, lazy=True), repeat
+    )
+
+    kconfig = KConfig(klipper)
+    bdb = BoardDatabase(boards_path)
+    config_path = workdir / "bench.config"
+    for arch in range(archs):
+        # The first board of each architecture
+        board = bdb.get(*board_key(arch, 0))
+        results[f"configurator/arch{arch}"] = _time(
+            lambda: Configurator(klipper, board, kconfig), repeat, setup=_cold_plans
+        )
+        config = Configurator(klipper, board, kconfig)
+        for interface in board.interfaces:
+            results[f"set_interface/{interface.if_type.lower()}/arch{arch}"] = _time(
+                lambda: config.set_interface(interface), repeat, setup=_cold_plans
+            )
+        results[f"save_config/arch{arch}"] = _time(
+            lambda: config.save_config(config_path), repeat
+        )
+
+    return {
+        "meta": {
+            "ezflash_revision": git_revision(Path(__file__).parent),
+            "python": platform.python_version(),
+            "kconfiglib": ".".join(str(x) for x in KCL_VERSION),
+            "machine": platform.machine(),
+            "archs": archs,
+            "mcus": mcus,
+            "comms": comms,
+            "repeat": repeat,
+        },
+        "results": results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Time the board to kconfig pipeline against a synthetic klipper tree, reporting JSON"
+    )
+    parser.add_argument(
+        "--archs", type=int, default=4, help="Architectures in the synthetic tree"
+    )
+    parser.add_argument(
+        "--mcus", type=int, default=16, help="Processor models per architecture"
+    )
+    parser.add_argument(
+        "--comms",
+        type=int,
+        default=4,
+        help="Serial and CAN options per architecture",
+    )
+    parser.add_argument(
+        "-r", "--repeat", type=int, default=5, help="Runs of each benchmark"
+    )
+    parser.add_argument(
+        "-o", "--output", type=Path, help="Write results here instead of stdout"
+    )
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="ezf-bench-") as workdir:
+        report = run(Path(workdir), args.archs, args.mcus, args.comms, args.repeat)
+
+    if args.output:
+        args.output.write_text(json.dumps(report, indent=2))
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == "__main__":
+    main()
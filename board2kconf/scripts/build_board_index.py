@@ -0,0 +1,33 @@
+import argparse
+from pathlib import Path
+
+from ..model import BoardDatabase
+from ..util import get_boards_path
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Precompile the board database into an index that loads faster"
+    )
+    parser.add_argument(
+        "source",
+        nargs="?",
+        type=Path,
+        help="The board database to compile (defaults to the one ezflash would use)",
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        type=Path,
+        help="Where to write the index (defaults to alongside the source, with a .idx suffix)",
+    )
+    args = parser.parse_args()
+
+    source = args.source or Path(str(get_boards_path()))
+    output = args.output or source.with_suffix(".idx")
+    count = BoardDatabase(source).write_index(output)
+    print(f"Wrote {count} boards to {output}")
+
+
+if __name__ == "__main__":
+    main()
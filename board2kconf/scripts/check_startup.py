@@ -0,0 +1,94 @@
+import argparse
+import subprocess
+import sys
+
+# What `ezf` imports before it can show the first dialog
+_STARTUP_MODULES = ("board2kconf.__main__", "board2kconf.ui")
+# These are only needed to generate a config, and must never slow down startup
+_FORBIDDEN_MODULES = ("kconfiglib", "board2kconf.configurator", "board2kconf.kconfig")
+# The scripted (non-interactive) commands must work without pythondialog installed
+_SCRIPTED_COMMAND = ("-m", "board2kconf", "boards", "--json")
+_UI_MODULES = ("dialog", "board2kconf.ui")
+# Startup measures ~65ms on an x86 CI runner, this leaves room for noise but not for a heavy new import.
+# Slower machines (a Pi Zero imports ~20x slower) need their own --budget-ms.
+_DEFAULT_BUDGET_MS = 100
+
+
+def measure_imports(modules):
+    """
+    Import modules in a fresh interpreter.
+    Returns {module: cumulative import time} and the total import time, in microseconds
+    """
+    return _run_importtime(["-c", "; ".join(f"import {m}" for m in modules)])
+
+
+def _run_importtime(args):
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", *args],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    times = {}
+    total = 0
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        fields = line.removeprefix("import time:").split("|")
+        try:
+            cumulative = int(fields[1])
+        except ValueError:
+            # Column headings
+            continue
+        name = fields[2].lstrip(" ")
+        times[name.strip()] = cumulative
+        # Nested imports are indented beneath the import that triggered them, and counted in its time
+        if len(fields[2]) - len(name) == 1:
+            total += cumulative
+    return times, total
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Check that ezf starts quickly, and does not import kconfiglib until it needs it"
+    )
+    parser.add_argument(
+        "--budget-ms",
+        type=float,
+        default=_DEFAULT_BUDGET_MS,
+        help=f"Maximum time to import ezf's startup modules (default {_DEFAULT_BUDGET_MS}ms)",
+    )
+    args = parser.parse_args()
+
+    # Run twice, so the measurement doesn't include compiling bytecode
+    measure_imports(_STARTUP_MODULES)
+    times, total = measure_imports(_STARTUP_MODULES)
+
+    failures = []
+    for module in _FORBIDDEN_MODULES:
+        if module in times:
+            failures.append(f"{module} is imported at startup")
+    scripted_times, _ = _run_importtime(_SCRIPTED_COMMAND)
+    for module in _UI_MODULES:
+        if module in scripted_times:
+            failures.append(
+                f"{module} is imported by `ezf {' '.join(_SCRIPTED_COMMAND[2:])}`"
+            )
+    total_ms = total / 1000
+    print(f"Startup imports took {total_ms:.1f}ms (budget {args.budget_ms:.0f}ms)")
+    if total_ms > args.budget_ms:
+        failures.append("Startup imports exceeded budget")
+        for module, cumulative in sorted(times.items(), key=lambda x: -x[1])[:10]:
+            print(f"  {cumulative / 1000:8.1f}ms {module}")
+
+    if failures:
+        print("==== FAIL ====")
+        for failure in failures:
+            print(failure)
+        raise SystemExit(1)
+    else:
+        print("==== PASS ====")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,35 +1,269 @@
-from ..util import find_klipper, get_boards
+import argparse
+import hashlib
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional, Collection, Tuple, Dict
+
+from ..util import (
+    find_klipper,
+    get_boards,
+    get_cache_dir,
+    git_revision,
+    hash_file,
+    code_fingerprint,
+    write_atomic,
+)
+from ..kconfig import kconfig_fingerprint
 from ..model import BoardDefinition
-from ..configurator import Configurator
+from ..configurator import Configurator, shared_kconfig
 from pathlib import Path
 
 import logging
 
 _DIE_FAST = False
 
+# Bump this whenever the layout of the result store changes
+_STORE_FORMAT = 1
+
+
+class ResultStore(object):
+    """
+    Results of previous checks against one klipper checkout.
+    Each is keyed on the board definition, and is only reused while the kconfig files it touched are unchanged.
+    """
+
+    def __init__(self, path: Path, klipper: Path):
+        self.path = path
+        self.klipper = klipper
+        self._code = code_fingerprint()
+        self._file_hashes: Dict[str, Optional[str]] = {}
+        self._results = self._load()
+        self._current = {}
+
+    def _load(self) -> Dict:
+        try:
+            data = json.loads(self.path.read_text())
+        except (OSError, ValueError):
+            return {}
+        if data.get("format") != _STORE_FORMAT or data.get("code") != self._code:
+            return {}
+        return data.get("results", {})
+
+    def _hash(self, filename: str) -> Optional[str]:
+        if filename not in self._file_hashes:
+            self._file_hashes[filename] = hash_file(self.klipper / filename)
+        return self._file_hashes[filename]
+
+    def get(self, board: BoardDefinition) -> Optional[List[str]]:
+        key = board.content_hash()
+        if not (record := self._results.get(key)):
+            return None
+        if any(self._hash(f) != h for f, h in record["files"].items()):
+            return None
+        self._current[key] = record
+        return record["failures"]
+
+    def put(self, board: BoardDefinition, failures: List[str], files: Collection[str]):
+        if not files:
+            # Without knowing what it depends on, the result can never be invalidated
+            return
+        self._current[board.content_hash()] = {
+            "board": str(board),
+            "files": {f: self._hash(f) for f in sorted(files)},
+            "failures": failures,
+        }
+
+    def save(self):
+        # Only results for boards that still exist are kept
+        write_atomic(
+            self.path,
+            json.dumps(
+                {
+                    "format": _STORE_FORMAT,
+                    "code": self._code,
+                    "results": self._current,
+                }
+            ),
+        )
+
+
+def _default_store_path(klipper: Path) -> Optional[Path]:
+    if not (cache_dir := get_cache_dir("check_kboards")):
+        return None
+    key = hashlib.sha256(str(klipper.absolute()).encode("utf-8")).hexdigest()[:16]
+    return cache_dir / f"{key}.json"
+
+
+def check_board(klipper: Path, board: BoardDefinition) -> Tuple[List[str], List[str]]:
+    """
+    Run the configurator against every interface of a board.
+    Returns a description of each failure, and the kconfig files the checks depended on.
+    """
+    failures = []
+    files = set()
+    try:
+        # Parsed once per process, each board starts from a clean copy of the same tree
+        config = Configurator(klipper, board, shared_kconfig(klipper))
+        files.update(config.kconfig_files())
+
+        for i in config.get_interfaces():
+            try:
+                config.set_interface(i)
+            except Exception as e:
+                if _DIE_FAST:
+                    raise e
+                failures.append(f"{board}/{i}: {e!r}")
+            files.update(config.kconfig_files())
+    except Exception as e:
+        if _DIE_FAST:
+            raise e
+        failures.append(f"{board}: {e!r}")
+    return failures, sorted(files)
+
+
+def _check_board_task(task):
+    return check_board(*task)
+
+
+def _check_boards(
+    klippers: List[Path],
+    boards: List[BoardDefinition],
+    stores: Dict[Path, ResultStore],
+    jobs: int,
+) -> Dict[Path, List[List[str]]]:
+    """
+    Check every board against every klipper checkout, reusing stored results where they are still valid.
+    Returns the failures of each board (in board order), for each checkout.
+    """
+    results = {
+        klipper: [
+            store.get(board) if (store := stores.get(klipper)) else None
+            for board in boards
+        ]
+        for klipper in klippers
+    }
+    # Grouped by checkout, so each worker mostly sees (and has to load) a single tree
+    pending = [
+        (klipper, i)
+        for klipper in klippers
+        for i, result in enumerate(results[klipper])
+        if result is None
+    ]
+    tasks = [(klipper, boards[i]) for klipper, i in pending]
+    for klipper, store in stores.items():
+        unchanged = sum(x is not None for x in results[klipper])
+        of = f" of {klipper}" if len(klippers) > 1 else ""
+        print(f"{unchanged} boards unchanged since the last check{of}")
+    if jobs > 1 and len(tasks) > 1:
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            if len(klippers) > 1 and get_cache_dir("kconfig"):
+                # Parse (and cache) each checkout's kconfig once, in parallel, rather than in every worker at once
+                list(pool.map(kconfig_fingerprint, dict.fromkeys(x for x, _ in tasks)))
+            # map() yields in submission order, so the output matches a serial run
+            checked = pool.map(
+                _check_board_task, tasks, chunksize=max(1, len(tasks) // (jobs * 4))
+            )
+            checked = list(checked)
+    else:
+        checked = [_check_board_task(task) for task in tasks]
+
+    for (klipper, i), (result, files) in zip(pending, checked):
+        results[klipper][i] = result
+        if store := stores.get(klipper):
+            store.put(boards[i], result, files)
+    for store in stores.values():
+        store.save()
+    return results
+
+
+def _print_matrix(
+    klippers: List[Path],
+    boards: List[BoardDefinition],
+    results: Dict[Path, List[List[str]]],
+):
+    """
+    Print a board x checkout pass/fail grid
+    """
+    labels = [f"r{i}" for i in range(1, len(klippers) + 1)]
+    for label, klipper in zip(labels, klippers):
+        revision = git_revision(klipper)
+        print(
+            f"{label}: {klipper} ({revision[:12] if revision else 'not a git checkout'})"
+        )
+    names = [str(board) for board in boards]
+    width = max(len(x) for x in names + ["Board"])
+    print(f"{'Board':<{width}}  " + "  ".join(f"{x:<4}" for x in labels).rstrip())
+    for i, name in enumerate(names):
+        cells = ["FAIL" if results[klipper][i] else "ok" for klipper in klippers]
+        print(f"{name:<{width}}  " + "  ".join(f"{x:<4}" for x in cells).rstrip())
+    for label, klipper in zip(labels, klippers):
+        failed = sum(bool(x) for x in results[klipper])
+        print(f"{label}: {len(boards) - failed} passed, {failed} failed")
+
 
 def main():
+    parser = argparse.ArgumentParser(
+        description="Run the configurator against every known board and interface"
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=1,
+        help="Number of boards to check in parallel (0 for one per CPU)",
+    )
+    parser.add_argument(
+        "-i",
+        "--incremental",
+        action="store_true",
+        help="Only re-check boards whose definition, or klipper kconfig, changed since the last incremental run",
+    )
+    parser.add_argument(
+        "--results",
+        type=Path,
+        help="Where to keep results for --incremental (defaults to the ezflash cache)",
+    )
+    parser.add_argument(
+        "-k",
+        "--klipper",
+        type=Path,
+        action="append",
+        help="Klipper checkout (or worktree) to check against, repeat to compare several (default: autodetect)",
+    )
+    args = parser.parse_args()
+    jobs = args.jobs or os.cpu_count() or 1
+
     boards = BoardDefinition.get_all()
 
-    klipper = find_klipper()
-    failures = []
-    print(f"Checking {len(boards)} boards...")
-    for board in boards:
-        try:
-            config = Configurator(klipper, board)
-
-            for i in config.get_interfaces():
-                try:
-                    config.set_interface(i)
-                except Exception as e:
-                    if _DIE_FAST:
-                        raise e
-                    failures.append(f"{board}/{i}: {e!r}")
-        except Exception as e:
-            if _DIE_FAST:
-                raise e
-            failures.append(f"{board}: {e!r}")
+    klippers = list(
+        dict.fromkeys(x.absolute() for x in args.klipper or [find_klipper()])
+    )
+    if args.results and len(klippers) > 1:
+        parser.error("--results can only be used with a single klipper checkout")
+    stores = {}
+    if args.incremental:
+        for klipper in klippers:
+            if store_path := args.results or _default_store_path(klipper):
+                stores[klipper] = ResultStore(store_path, klipper)
+            else:
+                logging.warning("No cache directory available, checking all boards")
+                break
+    if len(klippers) > 1:
+        print(
+            f"Checking {len(boards)} boards against {len(klippers)} klipper checkouts..."
+        )
+    else:
+        print(f"Checking {len(boards)} boards...")
+
+    results = _check_boards(klippers, boards, stores, jobs)
+    if len(klippers) > 1:
+        _print_matrix(klippers, boards, results)
 
+    failures = []
+    for label, klipper in enumerate(klippers, 1):
+        prefix = f"r{label}: " if len(klippers) > 1 else ""
+        failures.extend(prefix + x for result in results[klipper] for x in result)
     if failures:
         print("==== FAIL ====")
         for failure in failures:
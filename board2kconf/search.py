@@ -0,0 +1,155 @@
+import heapq
+import re
+from bisect import bisect_left
+from typing import Dict, Hashable, Iterable, List, Optional, Set, Tuple
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+# Part numbers run words together, "stm32f446" is also indexed as "stm32" and "f446"
+_SUBWORD_SPLIT_RE = re.compile(r"(?<=[0-9])(?=[a-z])")
+# How much a query word matching a word of a board counts for, depending on how it matched
+_EXACT_SCORE = 1.0
+_PREFIX_SCORE = 0.8
+_FUZZY_SCORE = 0.6
+# Below this trigram similarity, words are not considered to match at all
+_MIN_SIMILARITY = 0.25
+
+
+def tokenize(text: str) -> List[str]:
+    return _TOKEN_RE.findall(text.lower())
+
+
+def _index_words(text: str) -> Set[str]:
+    words = set()
+    for token in tokenize(text):
+        words.add(token)
+        words.update(_SUBWORD_SPLIT_RE.split(token))
+    return words
+
+
+def _trigrams(token: str) -> Set[str]:
+    padded = f"${token}$"
+    return {padded[i : i + 3] for i in range(len(padded) - 2)}
+
+
+class SearchIndex(object):
+    """
+    A word index for fuzzy lookups of short documents (such as a board's names and MCU).
+
+    Every query word must match a word of a document, either exactly, as a prefix ("oct" finds "octopus"),
+    or by trigram similarity (to forgive typos, "ocotpus" finds "octopus"). Documents are ranked by how well
+    their words matched.
+    """
+
+    def __init__(self, documents: Iterable[Tuple[Hashable, Iterable[str]]]):
+        """
+        :param documents: (key, texts) for each document, keys are returned by search
+        """
+        self._keys: List[Hashable] = []
+        # word -> documents containing it
+        self._postings: Dict[str, Set[int]] = {}
+        for position, (key, texts) in enumerate(documents):
+            self._keys.append(key)
+            for text in texts:
+                for word in _index_words(text or ""):
+                    self._postings.setdefault(word, set()).add(position)
+        self._vocabulary = sorted(self._postings)
+        # Equally good matches are listed in key order
+        self._key_order = [0] * len(self._keys)
+        for rank, position in enumerate(
+            sorted(range(len(self._keys)), key=lambda x: str(self._keys[x]))
+        ):
+            self._key_order[position] = rank
+        # trigram -> words containing it
+        self._trigram_words: Dict[str, Set[str]] = {}
+        self._trigram_counts: Dict[str, int] = {}
+        for token in self._vocabulary:
+            trigrams = _trigrams(token)
+            self._trigram_counts[token] = len(trigrams)
+            for trigram in trigrams:
+                self._trigram_words.setdefault(trigram, set()).add(token)
+
+    def __len__(self):
+        return len(self._keys)
+
+    def state(self) -> Tuple:
+        """
+        The index as plain data, for marshal (see from_state)
+        """
+        return (
+            self._keys,
+            self._postings,
+            self._vocabulary,
+            self._key_order,
+            self._trigram_words,
+            self._trigram_counts,
+        )
+
+    @classmethod
+    def from_state(cls, state: Tuple) -> "SearchIndex":
+        index = cls.__new__(cls)
+        (
+            index._keys,
+            index._postings,
+            index._vocabulary,
+            index._key_order,
+            index._trigram_words,
+            index._trigram_counts,
+        ) = state
+        return index
+
+    def _word_matches(self, query: str) -> Dict[str, float]:
+        """
+        Return the indexed words matching a query word, with how well they match
+        """
+        matches: Dict[str, float] = {}
+        query_trigrams = _trigrams(query)
+        shared: Dict[str, int] = {}
+        for trigram in query_trigrams:
+            for word in self._trigram_words.get(trigram, ()):
+                shared[word] = shared.get(word, 0) + 1
+        for word, count in shared.items():
+            union = len(query_trigrams) + self._trigram_counts[word] - count
+            similarity = count / union
+            if similarity >= _MIN_SIMILARITY:
+                matches[word] = _FUZZY_SCORE * similarity
+        position = bisect_left(self._vocabulary, query)
+        while position < len(self._vocabulary) and self._vocabulary[
+            position
+        ].startswith(query):
+            word = self._vocabulary[position]
+            matches[word] = _EXACT_SCORE if word == query else _PREFIX_SCORE
+            position += 1
+        return matches
+
+    def search(self, text: str, limit: int = 20) -> List[Tuple[float, Hashable]]:
+        """
+        Return up to limit (score, key) pairs for the documents matching text, best first
+        """
+        matches = [self._word_matches(query) for query in dict.fromkeys(tokenize(text))]
+        if not matches or not all(matches):
+            return []
+        # Start from the most selective query word, so later ones only have to score its candidates
+        matches.sort(key=lambda x: sum(len(self._postings[word]) for word in x))
+        scores: Optional[Dict[int, float]] = None
+        for word_scores in matches:
+            best: Dict[int, float] = {}
+            for word, score in word_scores.items():
+                documents = self._postings[word]
+                if scores is not None:
+                    # Every query word has to match something
+                    documents = scores.keys() & documents
+                for document in documents:
+                    if score > best.get(document, 0):
+                        best[document] = score
+            if scores is not None:
+                best = {
+                    document: scores[document] + score
+                    for document, score in best.items()
+                }
+            if not best:
+                return []
+            scores = best
+        ranked = heapq.nsmallest(
+            limit, scores.items(), key=lambda x: (-x[1], self._key_order[x[0]])
+        )
+        return [(score, self._keys[document]) for document, score in ranked]
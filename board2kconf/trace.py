@@ -0,0 +1,121 @@
+"""
+Opt-in tracing of where the time goes while generating a config.
+
+Set KBOARD_TRACE to a file path (or pass --trace to ezf) and timed spans are recorded around the kconfig parse, every
+Configurator.set_* call, symbol and choice lookups, and save_config. At exit they are written to that file as Chrome
+trace events (open it in chrome://tracing or https://ui.perfetto.dev), and a per-stage summary is printed to stderr.
+
+Functions are only wrapped if tracing is enabled when their module is imported, so tracing costs nothing when it is off,
+but must be enabled before the configurator is imported. Only the process that enabled tracing writes spans out.
+"""
+
+import atexit
+import functools
+import json
+import os
+import sys
+import threading
+import time
+from typing import Callable, List, Optional, Tuple
+
+_trace_path: Optional[str] = None
+# (name, start ns, end ns, thread id)
+_spans: List[Tuple[str, int, int, int]] = []
+_origin = time.perf_counter_ns()
+
+
+def enable(path: str):
+    """
+    Start tracing, writing the trace to path at exit
+    """
+    global _trace_path
+    if _trace_path is None:
+        atexit.register(_finish, os.getpid())
+    _trace_path = path
+
+
+def enabled() -> bool:
+    return _trace_path is not None
+
+
+def span(name: Optional[str] = None) -> Callable:
+    """
+    Decorate a function to record a span each time it is called (if tracing is enabled)
+    :param name: Name of the span, defaults to the function's qualified name
+    """
+
+    def decorator(fn):
+        if _trace_path is None:
+            return fn
+        label = name or fn.__qualname__
+
+        @functools.wraps(fn)
+        def traced(*args, **kwargs):
+            start = time.perf_counter_ns()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                _spans.append(
+                    (label, start, time.perf_counter_ns(), threading.get_ident())
+                )
+
+        return traced
+
+    return decorator
+
+
+def chrome_trace() -> dict:
+    pid = os.getpid()
+    return {
+        "traceEvents": [
+            {
+                "name": name,
+                "cat": name.split(".")[0],
+                "ph": "X",
+                "ts": (start - _origin) / 1000,
+                "dur": (end - start) / 1000,
+                "pid": pid,
+                "tid": tid,
+            }
+            for name, start, end, tid in _spans
+        ],
+        "displayTimeUnit": "ms",
+    }
+
+
+def summary() -> str:
+    """
+    Return a table of calls and time spent per span name, most expensive first.
+    Times include any nested spans.
+    """
+    stages = {}
+    for name, start, end, _ in _spans:
+        stage = stages.setdefault(name, [0, 0, 0])
+        stage[0] += 1
+        stage[1] += end - start
+        stage[2] = max(stage[2], end - start)
+    width = max([len(name) for name in stages] + [5])
+    lines = [
+        f"{'Stage':<{width}} {'Calls':>7} {'Total ms':>10} {'Mean ms':>9} {'Max ms':>9}"
+    ]
+    for name, (calls, total, longest) in sorted(stages.items(), key=lambda x: -x[1][1]):
+        lines.append(
+            f"{name:<{width}} {calls:>7} {total / 1e6:>10.2f} {total / calls / 1e6:>9.3f} {longest / 1e6:>9.3f}"
+        )
+    return "\n".join(lines)
+
+
+def _finish(pid: int):
+    if os.getpid() != pid or _trace_path is None:
+        # A forked child, its parent writes the trace
+        return
+    try:
+        with open(_trace_path, "w") as f:
+            json.dump(chrome_trace(), f)
+    except OSError as e:
+        print(f"Could not write trace to {_trace_path}: {e}", file=sys.stderr)
+    print(summary(), file=sys.stderr)
+
+
+if trace_path := os.environ.get("KBOARD_TRACE"):
+    enable(trace_path)
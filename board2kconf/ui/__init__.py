@@ -1,15 +1,23 @@
-from sys import exit, stderr
-import traceback
-
-from ..model import BoardDatabase
-
-from dialog import Dialog
+import time
 import traceback
 from sys import exit, stderr
 
 from dialog import Dialog
 
-from ..model import BoardDatabase
+from ..preload import Preloader
+
+
+def _load_boards():
+    from ..model import BoardDatabase
+
+    return BoardDatabase.default()
+
+
+def _load_kconfig():
+    from ..configurator import shared_kconfig
+    from ..util import find_klipper
+
+    return shared_kconfig(find_klipper())
 
 
 class UI(object):
@@ -17,6 +25,31 @@ class UI(object):
         self._state = 0
         self._dialog = Dialog(dialog="dialog", autowidgetsize=True)
         self._dialog.add_persistent_args(("--no-collapse",))
+        # Started by launch(), so loading happens while the user reads the first dialogs
+        self._preloader = Preloader({"boards": _load_boards, "kconfig": _load_kconfig})
+
+    def _loaded(self, name: str, text: str):
+        """
+        Return a preloaded result, showing a gauge if the user got here before it finished loading
+        """
+        if not self._preloader.done(name):
+            started = time.monotonic()
+            self._dialog.gauge_start(text, height=7, width=50)
+            while not self._preloader.wait(name, 0.1):
+                # How long loading takes is unknown, so creep towards (but never reach) the end
+                elapsed = time.monotonic() - started
+                self._dialog.gauge_update(int(100 - 100 / (1 + elapsed)))
+            self._dialog.gauge_stop()
+        return self._preloader.result(name)
+
+    def board_database(self):
+        return self._loaded("boards", "Loading the board database...")
+
+    def kconfig(self):
+        """
+        The parsed klipper Kconfig tree, for the configuration steps
+        """
+        return self._loaded("kconfig", "Reading klipper's configuration options...")
 
     def main_menu(self):
         self._dialog.set_background_title("Main Menu")
@@ -24,6 +57,7 @@ class UI(object):
             "What would you like to do?",
             choices=[
                 ("boardinfo", "Lookup information about a board"),
+                ("search", "Search for a board"),
                 ("crash", "Intentionally crash"),
                 ("exit", "Exit"),
             ],
@@ -31,9 +65,8 @@ class UI(object):
         )
 
     def select_board(self):
-        bdb = BoardDatabase()
-        board = bdb.get_all()
-        manufacturers = tuple(sorted(set([b.manufacturer for b in board])))
+        bdb = self.board_database()
+        manufacturers = bdb.manufacturers()
         code, tag = self._dialog.menu(
             "Select manufacturer",
             choices=[(str(i), n) for i, n in enumerate(manufacturers)],
@@ -45,9 +78,7 @@ class UI(object):
             return None
         selected_mfr = manufacturers[int(tag)]
 
-        mfr_models = tuple(
-            sorted(set(b.model for b in board if b.manufacturer == selected_mfr))
-        )
+        mfr_models = bdb.models(selected_mfr)
         code, tag = self._dialog.menu(
             "Select model",
             choices=[(str(i), n) for i, n in enumerate(mfr_models)],
@@ -59,15 +90,14 @@ class UI(object):
             return None
         selected_model = mfr_models[int(tag)]
 
-        board_variants = tuple(
-            sorted(
-                set(
-                    b.variant
-                    for b in board
-                    if b.manufacturer == selected_mfr and b.model == selected_model
-                )
+        board_variants = bdb.variants(selected_mfr, selected_model)
+        if not board_variants:
+            self._dialog.msgbox(
+                f"No usable board data for {selected_mfr}/{selected_model}",
+                width=60,
+                height=6,
             )
-        )
+            return None
         if len(board_variants) > 1:
             code, tag = self._dialog.menu(
                 "Select variant",
@@ -81,14 +111,43 @@ class UI(object):
             selected_variant = board_variants[int(tag)]
         else:
             selected_variant = board_variants[0]
-        return bdb.get(selected_mfr, selected_model, selected_variant)
+        try:
+            return bdb.get(selected_mfr, selected_model, selected_variant)
+        except ValueError as e:
+            # e.g. a duplicate definition
+            self._dialog.msgbox(str(e), width=60, height=6)
+            return None
+
+    def search_board(self):
+        code, text = self._dialog.inputbox(
+            "Search for a board by manufacturer, model, variant or MCU", width=60
+        )
+        if code in (Dialog.CANCEL, Dialog.ESC) or not text.strip():
+            return None
+        boards = self.board_database().search(text, limit=50)
+        if not boards:
+            self._dialog.msgbox(f"No boards match {text}", width=60, height=6)
+            return None
+        code, tag = self._dialog.menu(
+            f"Boards matching {text}",
+            choices=[(str(i), str(board)) for i, board in enumerate(boards)],
+            no_tags=True,
+        )
+        if code in (Dialog.CANCEL, Dialog.ESC):
+            return None
+        if not tag:
+            return None
+        return boards[int(tag)]
 
     def menus(self):
         while True:
             code, tag = self.main_menu()
             if code == Dialog.OK:
-                if tag == "boardinfo":
-                    board = self.select_board()
+                if tag in ("boardinfo", "search"):
+                    if tag == "boardinfo":
+                        board = self.select_board()
+                    else:
+                        board = self.search_board()
                     if not board:
                         continue
                     self._dialog.msgbox(board.pretty(), width=100, height=20)
@@ -105,6 +164,7 @@ class UI(object):
             # Don't care
 
     def launch(self):
+        self._preloader.start()
         try:
             code = self._dialog.yesno(
                 "This is WIP tooling.\n\nIt may eat your cat and/or firmware\nBe warned!",
@@ -1,10 +1,16 @@
+import hashlib
+import json
 import os
+import subprocess
+import threading
+from contextlib import contextmanager
 from functools import cache
 from pathlib import Path
 
 from importlib.resources import files
 
-from typing import Collection, Any
+from os import PathLike
+from typing import Collection, Any, Iterator, Optional
 
 _COMMON_KLIPPER_LOCATIONS = ["~/klipper", "~/Klipper", "/usr/src/klipper"]
 
@@ -23,21 +29,166 @@ def find_klipper():
     raise RuntimeError("Could not find the klipper checkout")
 
 
-def get_boards():
+def get_cache_dir(*parts: str) -> Optional[Path]:
+    """
+    Return (creating it if needed) a directory under the ezflash cache, or None if caching is unavailable
+    """
+    if (override_path := os.environ.get("KBOARD_CACHE_PATH")) is not None:
+        if not override_path:
+            # Explicitly disabled
+            return None
+        base = Path(override_path)
+    elif xdg_path := os.environ.get("XDG_CACHE_HOME"):
+        base = Path(xdg_path) / "ezflash"
+    else:
+        base = Path("~/.cache/ezflash").expanduser()
+    path = base.joinpath(*parts)
+    try:
+        path.mkdir(parents=True, exist_ok=True)
+    except OSError:
+        return None
+    return path
+
+
+def hash_file(path: PathLike) -> Optional[str]:
+    """
+    Return the sha256 of a file's contents, or None if it cannot be read
+    """
+    try:
+        return hashlib.sha256(Path(path).read_bytes()).hexdigest()
+    except OSError:
+        return None
+
+
+@contextmanager
+def atomic_write(path: PathLike) -> Iterator[Path]:
+    """
+    Yield a temporary path to write the new contents of path to, which replaces path once the block completes,
+    so readers (including other processes writing the same file) only ever see a complete file.
+    The temporary file is removed if the block fails.
+    """
+    path = Path(path)
+    # Unique to this process and thread, so concurrent writers never share one
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    try:
+        yield tmp_path
+        tmp_path.replace(path)
+    finally:
+        tmp_path.unlink(missing_ok=True)
+
+
+def write_atomic(path: PathLike, data: str | bytes):
+    """
+    Write data to path through atomic_write
+    """
+    with atomic_write(path) as tmp_path:
+        if isinstance(data, str):
+            tmp_path.write_text(data)
+        else:
+            tmp_path.write_bytes(data)
+
+
+def normalise_config(path: PathLike) -> str:
+    """
+    Return the settings of a .config, without the comments and blank lines that do not affect a build
+    (such as the timestamped header written by the configurator). "# CONFIG_X is not set" lines are kept.
+    """
+    lines = []
+    for line in Path(path).read_text().splitlines():
+        line = line.strip()
+        if line and (not line.startswith("#") or line.startswith("# CONFIG_")):
+            lines.append(line)
+    return "\n".join(lines) + "\n"
+
+
+# A change to any of these can change the configuration generated for a board
+_CODE_MODULES = ("configurator.py", "kconfig.py", "model.py", "prompts.py", "util.py")
+
+
+@cache
+def code_fingerprint() -> str:
+    """
+    Return a hash of the parts of ezflash that decide what configuration is generated for a board
+    """
+    package = Path(__file__).parent
+    return hashlib.sha256(
+        json.dumps([hash_file(package / name) for name in _CODE_MODULES]).encode(
+            "utf-8"
+        )
+    ).hexdigest()
+
+
+def git_revision(path: PathLike) -> Optional[str]:
+    """
+    Return the commit checked out at path, or None if it is not a git checkout
+    """
+    try:
+        result = subprocess.run(
+            ["git", "-C", str(path), "rev-parse", "HEAD"],
+            capture_output=True,
+            text=True,
+        )
+    except OSError:
+        return None
+    if result.returncode != 0:
+        return None
+    return result.stdout.strip()
+
+
+def git_is_clean(path: PathLike) -> bool:
+    """
+    Return whether the tracked files of the git checkout at path match its HEAD (untracked files are ignored)
+    """
+    try:
+        result = subprocess.run(
+            ["git", "-C", str(path), "status", "--porcelain", "--untracked-files=no"],
+            capture_output=True,
+            text=True,
+        )
+    except OSError:
+        return False
+    return result.returncode == 0 and not result.stdout.strip()
+
+
+def get_boards_path():
     if override_path := os.environ.get("KBOARD_BOARDS_PATH"):
         path = Path(override_path)
         if path.exists():
-            return path.open()
+            return path
         else:
             raise ValueError("Specified KBOARD_BOARDS_PATH does not exist")
     try:
-        return files("board2kconf.data").joinpath("boards.json").open("r")
-    except (FileNotFoundError, ModuleNotFoundError):
+        return files("board2kconf.data").joinpath("boards.json")
+    except ModuleNotFoundError:
         pass
     # Try other options here
     raise RuntimeError("Could not find the board database")
 
 
+def get_boards():
+    try:
+        return get_boards_path().open("r")
+    except FileNotFoundError:
+        raise RuntimeError("Could not find the board database")
+
+
+def get_board_index() -> Optional[Path]:
+    """
+    Return the precompiled index of the board database, if there is one newer than the database itself
+    """
+    boards_path = get_boards_path()
+    if not isinstance(boards_path, Path):
+        # Only plain files carry a usable mtime
+        return None
+    index_path = boards_path.with_suffix(".idx")
+    try:
+        if index_path.stat().st_mtime_ns > boards_path.stat().st_mtime_ns:
+            return index_path
+    except OSError:
+        pass
+    return None
+
+
 def cajole_collection(in_val: Any):
     if type(in_val) is str:
         return in_val
@@ -210,6 +210,9 @@ main() {
   log "editable installation"
   "$pyenv/bin/pip" install -e "$repodir" |& log_tee pip | dialog --progressbox "Development Installation" 20 80
 
+  dialog --infobox "Indexing boards..." 3 30
+  "$pyenv/bin/build_kboard_index" |& log_tee build-index >/dev/null
+
   dialog --infobox "Creating Symlinks..."
   [[ -d $HOME/.local/bin ]] || mkdir -p "$HOME/.local/bin"
   ln -s "$pyenv/bin/ezf" "$HOME/.local/bin"